@@ -0,0 +1,118 @@
+"""
+Benchmarks for pyperc, written for airspeed velocity (asv).  From this 
+directory, run
+
+    asv run
+    asv publish
+
+Each benchmark reports time (time_*) and peak memory (peakmem_*) across 
+regular grids of 10^3 to 10^6 pores, so regressions and scaling behavior 
+are visible.  Setup is repeated before each sample.
+"""
+import os
+import numpy as np
+import pyperc
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 
+                        'examples', 'data')
+
+# Number of pores, grid dimensions (Nx, Ny, Nz)
+grid_sizes = {1000: (10, 10, 10), 
+              10000: (100, 10, 10), 
+              100000: (100, 100, 10), 
+              1000000: (100, 100, 100)}
+
+cell_size = 0.0005 # m
+radius = (0.0002, 0.00005, 0.00001) # mean, std, min (m)
+contact_angles = [65] # degrees
+invading_fluid_density = 1061 # kg/m3, Brine
+defending_fluid_density = 797 # kg/m3, Kerosene
+surface_tension = 0.05 # N/m
+
+def grid_model(num_pores, initialize=True):
+    """
+    Return an InvasionPercolation model on a regular grid
+    """
+    (Nx, Ny, Nz) = grid_sizes[num_pores]
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(Nx, Ny, Nz, cell_size, radius, 0, 123)
+    if initialize:
+        ip.initialize_pores(contact_angles, invading_fluid_density, 
+                            defending_fluid_density, surface_tension)
+    return ip
+
+class SetupGrid(object):
+    params = [sorted(grid_sizes)]
+    param_names = ['num_pores']
+    number = 1
+    timeout = 300
+    
+    def time_setup_grid(self, num_pores):
+        grid_model(num_pores, initialize=False)
+    
+    def peakmem_setup_grid(self, num_pores):
+        grid_model(num_pores, initialize=False)
+
+class SetupNetwork(object):
+    number = 1
+    
+    def setup(self):
+        self.pore_file = os.path.join(data_dir, 'pore.txt')
+        self.throat_file = os.path.join(data_dir, 'throat.txt')
+    
+    def time_setup_network(self):
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_network(self.pore_file, self.throat_file)
+    
+    def peakmem_setup_network(self):
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_network(self.pore_file, self.throat_file)
+
+class InitializePores(object):
+    params = [sorted(grid_sizes)]
+    param_names = ['num_pores']
+    number = 1
+    timeout = 300
+    
+    def setup(self, num_pores):
+        self.ip = grid_model(num_pores, initialize=False)
+    
+    def time_initialize_pores(self, num_pores):
+        self.ip.initialize_pores(contact_angles, invading_fluid_density, 
+                                 defending_fluid_density, surface_tension)
+    
+    def peakmem_initialize_pores(self, num_pores):
+        self.ip.initialize_pores(contact_angles, invading_fluid_density, 
+                                 defending_fluid_density, surface_tension)
+
+class Run(object):
+    """
+    Run to breakthrough for p = 0 and p > 0.  The pandas engine is skipped 
+    above 10^4 pores, and the numba engine is skipped if numba is not 
+    installed.
+    """
+    params = [sorted(grid_sizes), [0, 0.1], ['pandas', 'heap', 'numba']]
+    param_names = ['num_pores', 'p', 'engine']
+    number = 1
+    timeout = 600
+    
+    def setup(self, num_pores, p, engine):
+        if (engine == 'pandas') and (num_pores > 10000):
+            raise NotImplementedError()
+        if (engine == 'numba') and (pyperc.model.numba is None):
+            raise NotImplementedError()
+        self.ip = grid_model(num_pores)
+        if engine == 'numba':
+            # Compile the kernel outside of the timed run
+            grid_model(1000).run(p=p, engine=engine)
+    
+    def time_run(self, num_pores, p, engine):
+        self.ip.run(p=p, seed=0, engine=engine)
+    
+    def peakmem_run(self, num_pores, p, engine):
+        self.ip.run(p=p, seed=0, engine=engine)
+    
+    def track_iterations(self, num_pores, p, engine):
+        self.ip.run(p=p, seed=0, engine=engine)
+        return len(self.ip.results)
+    track_iterations.unit = 'fills'
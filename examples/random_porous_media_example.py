@@ -5,7 +5,6 @@ model for simulating initial migration of dense non-aqueous phase liquids.
 """
 import matplotlib.pylab as plt
 import numpy as np
-import pandas as pd
 import pyperc
 
 plt.close('all')
@@ -125,20 +124,20 @@ plt.figure()
 plt.imshow(occupy[:,0,:], origin='lower')
 plt.title('Occupied pores')
 
-iteration = pd.Series(index=ip.pores.index, data=np.nan)
-iteration1 = pd.Series(index = ip.results.node, data = ip.results.index)
-iteration[iteration1.index] = iteration1
-iteration = iteration.values.reshape((Nz,Ny,Nx))
+# Images of the xz slice after all fills
+num_fills = max(len(ip.results), 1)
+(last, iteration) = list(pyperc.graphics.invasion_images(ip, frame_stride=num_fills))[-1]
 plt.figure()
-plt.imshow(iteration[:,0,:], origin='lower', cmap='nipy_spectral') 
+plt.imshow(iteration, origin='lower', cmap='nipy_spectral') 
 plt.colorbar()
 plt.title('Occupied pores, iteration')
 
-threshold = pd.Series(index=ip.pores.index, data=np.nan) 
-threshold1 = pd.Series(index = ip.results.node, data = ip.results.threshold.values)
-threshold[threshold1.index] = threshold1
-threshold = threshold.values.reshape((Nz,Ny,Nx))
+(last, threshold) = list(pyperc.graphics.invasion_images(ip, frame_stride=num_fills, 
+                                                          value='threshold'))[-1]
 plt.figure()
-plt.imshow(threshold[:,0,:], origin='lower', cmap='nipy_spectral') 
+plt.imshow(threshold, origin='lower', cmap='nipy_spectral') 
 plt.colorbar()
 plt.title('Occupied pores, threshold')
+
+# Animation of the invasion, one frame every 500 fills
+pyperc.graphics.plot_3d_animation(ip, frame_stride=500, filename='Animation.html')
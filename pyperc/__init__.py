@@ -1,5 +1,6 @@
 from pyperc import model
 from pyperc import graphics
+from pyperc import analysis
 
 __version__ = '0.1.0'
 
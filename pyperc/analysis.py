@@ -0,0 +1,322 @@
+import pandas as pd
+import numpy as np
+from pyperc.model import _components
+
+def _fill_positions(ip):
+    """
+    Return the pore position of each fill in ip.results, and a boolean
+    array of pores occupied before the run
+    """
+    fills = ip.pores.index.get_indexer(ip.results['node'].values)
+    filled = np.zeros(len(ip.pores), dtype=bool)
+    filled[fills] = True
+    initial = (ip.pores['occupy'].values > 0) & ~filled
+
+    return fills, initial
+
+def drainage_curve(ip, levels=False):
+    """
+    Compute the drainage (capillary pressure - saturation) curve from the
+    fill order of one run.
+
+    For invasion percolation with p = 0, the pores filled at an applied
+    pressure P are the pores filled before the running maximum threshold
+    exceeds P, so one run gives the saturation at every pressure level.
+    All values are computed with cumulative sums over ip.results.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    levels : bool
+        If True, return one row per pressure level (the saturation after
+        the last fill at each running maximum threshold), default = False
+        (one row per fill)
+
+    Returns
+    --------
+    pandas DataFrame indexed by iteration with columns
+        threshold : threshold of the fill (Pa)
+        pressure : running maximum threshold (Pa)
+        saturation : fraction of pores occupied by the invading fluid
+        volume_saturation : fraction of pore volume occupied by the
+        invading fluid, with the volume of each pore from its radius
+
+    Pores occupied before the run are included in the saturation.
+    """
+    (fills, initial) = _fill_positions(ip)
+    volume = 4.0/3.0*np.pi*np.power(ip.pores['radius'].values, 3)
+
+    threshold = ip.results['threshold'].values
+    pressure = np.maximum.accumulate(threshold)
+    count = np.sum(initial) + np.arange(1, len(fills)+1)
+    filled_volume = np.sum(volume[initial]) + np.cumsum(volume[fills])
+
+    curve = pd.DataFrame({'threshold': threshold,
+                          'pressure': pressure,
+                          'saturation': count/float(len(ip.pores)),
+                          'volume_saturation': filled_volume/np.sum(volume)},
+                         index=ip.results.index)
+    curve.index.name = 'iteration'
+    if levels:
+        last = np.append(pressure[1:] != pressure[:-1], len(pressure) > 0)
+        curve = curve[last[:len(pressure)]]
+
+    return curve
+
+def breakthrough_pressure(ip):
+    """
+    Return the breakthrough pressure (Pa), the running maximum threshold
+    when the first end pore is filled, or NaN if no end pore was filled
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    """
+    (fills, initial) = _fill_positions(ip)
+    outlet = np.flatnonzero(ip.pores['end'].values[fills] > 0)
+    if len(outlet) == 0:
+        return np.nan
+
+    return ip.results['threshold'].values[:outlet[0]+1].max()
+
+def _cluster_positions(ip, include_initial=False):
+    """
+    Return the x, y, z coordinates (N x 3 array) of the pores filled by the
+    run, in fill order, and of the pores occupied before the run if
+    include_initial is True
+    """
+    (fills, initial) = _fill_positions(ip)
+    coords = ip.pores[['x', 'y', 'z']].values
+    pos = coords[fills]
+    if include_initial:
+        pos = np.concatenate([coords[initial], pos])
+
+    return pos
+
+def cluster_growth(ip, include_initial=False):
+    """
+    Compute the mass, bounding box, vertical extent, and radius of gyration
+    of the invaded cluster after each fill, using running minimums,
+    maximums, and sums over the fill order
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    include_initial : bool
+        If True, pores occupied before the run are part of the cluster,
+        default = False
+
+    Returns
+    --------
+    pandas DataFrame indexed by iteration with columns mass (number of
+    pores), x_min, x_max, y_min, y_max, z_min, z_max, vertical_extent, and
+    radius_of_gyration
+    """
+    (fills, initial) = _fill_positions(ip)
+    pos = _cluster_positions(ip, include_initial)
+    skip = len(pos) - len(fills) # initially occupied pores
+
+    growth = pd.DataFrame(index=ip.results.index)
+    growth.index.name = 'iteration'
+    growth['mass'] = np.arange(skip+1, len(pos)+1)
+    for d, name in enumerate(['x', 'y', 'z']):
+        growth[name + '_min'] = np.minimum.accumulate(pos[:,d])[skip:]
+        growth[name + '_max'] = np.maximum.accumulate(pos[:,d])[skip:]
+    growth['vertical_extent'] = growth['z_max'] - growth['z_min']
+
+    mass = growth['mass'].values[:,np.newaxis]
+    center = np.cumsum(pos, axis=0)[skip:]/mass
+    square = np.cumsum(np.sum(pos**2, axis=1))[skip:]/mass[:,0]
+    growth['radius_of_gyration'] = np.sqrt(np.maximum(square - np.sum(center**2, axis=1), 0))
+
+    return growth
+
+def mass_radius(ip, num_radii=20, center=None, include_initial=False):
+    """
+    Compute the mass (number of pores) of the invaded cluster within a
+    radius of its center, at logarithmically spaced radii, and the mass
+    fractal dimension from the slope of log(mass) vs. log(radius)
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    num_radii : int
+        Number of radii
+    center : list of floats
+        Center (x, y, z), default = None (center of mass of the cluster)
+    include_initial : bool
+        If True, pores occupied before the run are part of the cluster,
+        default = False
+
+    Returns
+    --------
+    mass : pandas DataFrame with columns radius and mass
+    dimension : float
+        Mass fractal dimension
+
+    If no pore of the cluster is away from the center (fewer than two
+    pores), mass is empty and dimension is NaN.  If all pores are at the
+    same distance from the center, dimension is NaN.
+    """
+    pos = _cluster_positions(ip, include_initial)
+    if center is None:
+        center = pos.mean(axis=0) if len(pos) > 0 else np.zeros(3)
+    distance = np.sort(np.sqrt(np.sum((pos - np.asarray(center))**2, axis=1)))
+    if not np.any(distance > 0):
+        return pd.DataFrame({'radius': [], 'mass': []}), np.nan
+
+    r_min = distance[distance > 0].min()
+    if r_min == distance[-1]:
+        return pd.DataFrame({'radius': [r_min], 'mass': [len(distance)]}), np.nan
+    radius = np.geomspace(r_min, distance[-1], num_radii)
+    mass = pd.DataFrame({'radius': radius,
+                         'mass': np.searchsorted(distance, radius, side='right')})
+    dimension = np.polyfit(np.log(mass['radius']), np.log(mass['mass']), 1)[0]
+
+    return mass, dimension
+
+def box_counting(ip, sizes=None, include_initial=False):
+    """
+    Compute the number of boxes that contain the invaded cluster, for a
+    range of box sizes, and the box-counting dimension from the slope of
+    log(count) vs. log(1/size).  Boxes are counted by binning pore
+    coordinates to integer box coordinates.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    sizes : list of floats
+        Box sizes (m), default = None (10 sizes from the smallest distance
+        between pore coordinates to the extent of the cluster)
+    include_initial : bool
+        If True, pores occupied before the run are part of the cluster,
+        default = False
+
+    Returns
+    --------
+    count : pandas DataFrame with columns size and count
+    dimension : float
+        Box-counting dimension, NaN if there are fewer than two distinct sizes
+
+    If the cluster is empty, count is empty and dimension is NaN.
+    """
+    pos = _cluster_positions(ip, include_initial)
+    if len(pos) == 0:
+        return pd.DataFrame({'size': [], 'count': []}), np.nan
+    lo = pos.min(axis=0)
+    if sizes is None:
+        spacing = [np.diff(np.unique(pos[:,d])) for d in range(3)]
+        spacing = np.concatenate(spacing)
+        extent = np.max(pos.max(axis=0) - lo)
+        sizes = np.geomspace(spacing.min(), extent, 10) if len(spacing) > 0 else [1.0]
+
+    count = []
+    for size in sizes:
+        ijk = np.floor((pos - lo)/size + 1e-9).astype(np.int64)
+        key = np.ravel_multi_index(tuple(ijk.T), tuple(ijk.max(axis=0) + 1))
+        count.append(len(np.unique(key)))
+    count = pd.DataFrame({'size': sizes, 'count': count})
+    if len(np.unique(count['size'])) < 2:
+        return count, np.nan
+    dimension = -np.polyfit(np.log(count['size']), np.log(count['count']), 1)[0]
+
+    return count, dimension
+
+def finger_width(ip, num_layers=None):
+    """
+    Compute the number of fingers and mean finger width in each horizontal
+    layer of the invaded region.  Fingers are the connected components of
+    occupied pores within a layer, labeled for all layers at once.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    num_layers : int
+        Number of layers of equal thickness, default = None (one layer per
+        unique z coordinate, for regular grids)
+
+    Returns
+    --------
+    pandas DataFrame indexed by layer elevation (z, m) with columns pores
+    (number of occupied pores), fingers (number of fingers), and
+    mean_width (mean number of pores per finger)
+    """
+    network = ip.network
+    z = network.z
+    if num_layers is None:
+        (elevation, layer) = np.unique(z, return_inverse=True)
+    else:
+        edges = np.linspace(z.min(), z.max(), num_layers+1)
+        layer = np.clip(np.searchsorted(edges, z, side='right') - 1, 0, num_layers-1)
+        elevation = (edges[:-1] + edges[1:])/2
+
+    occupy = ip.pores['occupy'].values > 0
+    labels = _components(network.indptr, network.indices, occupy, layer)
+    pores = np.bincount(layer[occupy], minlength=len(elevation))
+    roots = occupy & (labels == np.arange(len(labels)))
+    fingers = np.bincount(layer[roots], minlength=len(elevation))
+
+    width = pd.DataFrame({'pores': pores, 'fingers': fingers}, index=elevation)
+    width.index.name = 'z'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        width['mean_width'] = pores/fingers.astype(float)
+
+    return width
+
+def invasion_tree(ip):
+    """
+    Return the invasion tree: for each pore filled by the run, the pore it
+    was invaded from, taken as its earliest filled neighbor (pores occupied
+    before the run are filled first)
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+
+    Returns
+    --------
+    pandas Series of the parent pore, indexed by filled pore in fill order
+    """
+    network = ip.network
+    (fills, initial) = _fill_positions(ip)
+    order = np.full(network.num_pores, np.iinfo(np.int64).max)
+    order[initial] = -1
+    order[fills] = np.arange(len(fills))
+
+    rows = np.repeat(np.arange(network.num_pores), np.diff(network.indptr))
+    neigh = network.indices
+    earlier = order[neigh] < order[rows]
+    (rows, neigh) = (rows[earlier], neigh[earlier])
+    first = np.lexsort((neigh, order[neigh], rows))
+    (rows, idx) = np.unique(rows[first], return_index=True)
+    parent = np.full(network.num_pores, -1)
+    parent[rows] = neigh[first][idx]
+
+    parent = parent[fills]
+    tree = pd.Series(network.index[parent[parent >= 0]],
+                     index=ip.results['node'].values[parent >= 0])
+    tree.index.name = 'node'
+
+    return tree
+
+def num_branches(ip):
+    """
+    Return the number of branches of the invaded cluster, counted as the
+    leaves of the invasion tree (filled pores that no other pore was
+    invaded from)
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    """
+    tree = invasion_tree(ip)
+
+    return int(np.sum(~np.isin(tree.index.values, tree.values)))
@@ -1,65 +1,125 @@
 import plotly
 import pandas as pd
+import numpy as np
+from pyperc.model import PoreNetwork, _csr_from_edges, _csr_gather
+
+def _network_arrays(G):
+    """
+    Return the pore index, positions (N x 3 array), and CSR adjacency
+    (indptr, indices) of a networkx graph (with a 'pos' node attribute),
+    PoreNetwork, or InvasionPercolation model
+    """
+    if hasattr(G, 'network'):
+        G = G.network
+    if isinstance(G, PoreNetwork):
+        pos = np.column_stack([G.x, G.y, G.z])
+        return G.index, pos, G.indptr, G.indices
+
+    index = pd.Index(list(G.nodes()))
+    pos = np.array([G.nodes[n]['pos'] for n in index], dtype=float).reshape(-1, 3)
+    edges = list(G.edges())
+    if len(edges) > 0:
+        (src, dst) = zip(*edges)
+        src = index.get_indexer(src).astype(np.int32)
+        dst = index.get_indexer(dst).astype(np.int32)
+    else:
+        src = dst = np.zeros(0, dtype=np.int32)
+    (indptr, indices) = _csr_from_edges(src, dst, len(index))
+
+    return index, pos, indptr, indices
+
+def _line_coordinates(pos, src, dst):
+    """
+    Return x, y, z arrays for line segments from pos[src] to pos[dst],
+    separated by NaN
+    """
+    segments = np.full((len(src), 3, 3), np.nan)
+    segments[:,0,:] = pos[src]
+    segments[:,1,:] = pos[dst]
+
+    return [segments[:,:,k].ravel() for k in range(3)]
 
 def plot_3d_network(G, node_attribute=None, title=None,
                node_size=7, node_range = [None,None], node_cmap='Viridis',
                link_width=1, add_colorbar=True, reverse_colormap=False,
-               figsize=[700, 450], node_labels=True, round_ndigits=2, 
+               figsize=[700, 450], node_labels=True, round_ndigits=2,
                filename=None, auto_open=True):
     """
     Create a 3D pore network graphic using plotly
+
+    Edge and node coordinates are built for the whole network at once from
+    the adjacency arrays, with NaN separating line segments.
+
+    Parameters
+    --------------
+    G : networkx graph, InvasionPercolation, or PoreNetwork
+        Pore network.  Graph nodes require a 'pos' attribute.
+    node_attribute : list, dict, or pandas Series
+        Nodes to plot (list) or node values used to color the nodes (dict or
+        Series, indexed by pore).  If given, only these nodes and their
+        edges are plotted.
     """
+    (index, pos, indptr, indices) = _network_arrays(G)
+
     # Node attribute
     if isinstance(node_attribute, list):
-        node_attribute = dict(zip(node_attribute,[1]*len(node_attribute)))
-    if isinstance(node_attribute, pd.Series):
-        node_attribute = dict(node_attribute)
-        
+        node_attribute = pd.Series(1, index=node_attribute)
+    if isinstance(node_attribute, dict):
+        node_attribute = pd.Series(node_attribute)
+    if node_attribute is not None and len(node_attribute) > 0:
+        nodes = index.get_indexer(node_attribute.index)
+        values = node_attribute.values[nodes >= 0]
+        labels = node_attribute.index[nodes >= 0]
+        nodes = nodes[nodes >= 0]
+        neigh = _csr_gather(indptr, indices, nodes)
+        src = np.repeat(nodes, np.diff(indptr)[nodes])
+        dst = neigh
+    else:
+        node_attribute = None
+        nodes = np.arange(len(index))
+        rows = np.repeat(np.arange(len(index)), np.diff(indptr))
+        src = rows[rows < indices]
+        dst = indices[rows < indices]
+
     # Create edge trace
+    (x, y, z) = _line_coordinates(pos, src, dst)
     edge_trace = plotly.graph_objs.Scatter3d(
-        x=[], 
-        y=[], 
-        z=[],
-        text=[],
-        hoverinfo='text',
+        x=x,
+        y=y,
+        z=z,
+        hoverinfo='none',
         mode='lines',
         line=dict(
             #colorscale=link_cmap,
             reversescale=reverse_colormap,
-            color='#888', #[], 
+            color='#888', #[],
             width=link_width))
-    if node_attribute:
-        A = pd.Series(dict([(n1,list(n2.keys())) for n1,n2 in G.adj.items()]))
-        for node in node_attribute.keys(): 
-            for neigh in A[node]:
-                x0, y0, z0 = G.node[node]['pos']
-                x1, y1, z1 = G.node[neigh]['pos']
-                edge_trace['x'] += tuple([x0, x1, None])
-                edge_trace['y'] += tuple([y0, y1, None])
-                edge_trace['z'] += tuple([z0, z1, None])
-    else:
-        for edge in list(G.edges()):
-            x0, y0, z0 = G.node[edge[0]]['pos']
-            x1, y1, z1 = G.node[edge[1]]['pos']
-            edge_trace['x'] += tuple([x0, x1, None])
-            edge_trace['y'] += tuple([y0, y1, None])
-            edge_trace['z'] += tuple([z0, z1, None])
-    
-    # Create node trace      
+
+    # Create node trace
+    color = []
+    text = []
+    if node_attribute is not None:
+        color = values
+        if node_labels:
+            try:
+                rounded = np.round(values.astype(float), round_ndigits)
+                text = ['Node ' + str(n) + ', ' + str(v) for n, v in zip(labels, rounded)]
+            except (TypeError, ValueError):
+                pass
     node_trace = plotly.graph_objs.Scatter3d(
-        x=[], 
-        y=[], 
-        z=[],
-        text=[],
+        x=pos[nodes,0],
+        y=pos[nodes,1],
+        z=pos[nodes,2],
+        text=text,
         hoverinfo='text',
-        mode='markers', 
+        mode='markers',
         marker=dict(
             showscale=add_colorbar,
-            colorscale=node_cmap, 
+            colorscale=node_cmap,
             cmin=node_range[0],
             cmax=node_range[1],
             reversescale=reverse_colormap,
-            color=[], 
+            color=color,
             size=node_size,
             #opacity=0.75,
             colorbar=dict(
@@ -67,46 +127,307 @@ def plot_3d_network(G, node_attribute=None, title=None,
                 xanchor='left',
                 titleside='right'),
             line=dict(width=0)))
-    if node_attribute:
-        nodes_to_plot = list(node_attribute.keys())
-    else:
-        nodes_to_plot = G.nodes()
-    for node in nodes_to_plot: 
-        x, y, z = G.node[node]['pos']
-        node_trace['x'] += tuple([x])
-        node_trace['y'] += tuple([y])
-        node_trace['z'] += tuple([z])
-
-        try:
-            # Add node attributes
-            node_trace['marker']['color'] += tuple([node_attribute[node]])
-            #node_trace['marker']['size'].append(node_size)
-            # Add node labels
-            if node_labels:
-                node_info = 'Node ' + str(node) + ', '+str(round(node_attribute[node],round_ndigits))
-                node_trace['text'] += tuple([node_info])
-        except:
-            pass
 
     #node_trace['marker']['colorbar']['title'] = 'Node colorbar title'
-    
+
     # Create figure
     data = [edge_trace, node_trace]
-    layout = plotly.graph_objs.Layout(
+    fig = plotly.graph_objs.Figure(data=data,layout=_layout(title))
+    _show(fig, filename, auto_open)
+
+def _voxel_bins(pos, num_bins):
+    """
+    Assign each position to a cubic voxel, with about num_bins voxels over
+    the bounding box.  Return the voxel of each position (zero based, in
+    order of the sorted voxel keys), the number of occupied voxels, and the
+    voxel size.  The size starts from the extent of the non-degenerate axes
+    (so 2D slab grids start from an area, not a volume) and grows by the
+    ratio of occupied voxels to num_bins until the count fits.
+    """
+    num_bins = max(num_bins, 1)
+    lo = pos.min(axis=0)
+    extent = pos.max(axis=0) - lo
+    extent = extent[extent > 0]
+    if len(extent) == 0:
+        return np.zeros(len(pos), dtype=np.int64), min(len(pos), 1), 1.0
+    size = (np.prod(extent)/num_bins)**(1.0/len(extent))
+    while True:
+        ijk = np.floor((pos - lo)/size).astype(np.int64)
+        dims = ijk.max(axis=0) + 1
+        key = np.ravel_multi_index(tuple(ijk.T), tuple(dims))
+        (unique_key, voxel) = np.unique(key, return_inverse=True)
+        if len(unique_key) <= num_bins:
+            return voxel, len(unique_key), size
+        size = size*max(1.1, (len(unique_key)/float(num_bins))**(1.0/len(extent)))
+
+def _voxel_surface(pos, size):
+    """
+    Return the vertices (x, y, z) and triangles (i, j, k) of the boundary of
+    the cubic voxels of the given size that contain pos
+    """
+    lo = pos.min(axis=0)
+    ijk = np.floor((pos - lo)/size).astype(np.int64) + 1 # pad by one voxel
+    occupied = np.zeros(tuple(ijk.max(axis=0) + 2), dtype=bool)
+    occupied[tuple(ijk.T)] = True
+
+    corners = []
+    for axis in range(3):
+        (a, b) = [d for d in range(3) if d != axis]
+        for side in [0, 1]:
+            exposed = occupied & ~np.roll(occupied, -1 if side else 1, axis=axis)
+            voxel = np.argwhere(exposed).astype(float)
+            face = np.repeat(voxel[:,np.newaxis,:], 4, axis=1)
+            face[:,:,axis] += side
+            face[:,:,a] += [0, 1, 1, 0]
+            face[:,:,b] += [0, 0, 1, 1]
+            corners.append(face)
+    corners = np.concatenate(corners)
+    xyz = (corners.reshape(-1, 3) - 1)*size + lo
+    first = 4*np.arange(len(corners))
+    triangles = (np.concatenate([first, first]), 
+                 np.concatenate([first + 1, first + 2]), 
+                 np.concatenate([first + 2, first + 3]))
+
+    return xyz, triangles
+
+def plot_3d_invasion(ip, max_points=100000, decimate='voxel', cluster='points',
+                     title=None, node_size=3, node_cmap='Viridis', seed=0,
+                     filename=None, auto_open=True):
+    """
+    Create a 3D graphic of the invaded cluster using plotly, decimated for
+    large networks
+
+    The invaded cluster (occupied pores, colored by fill order) and its
+    front are always shown in full.  Untouched pores are decimated so the
+    total number of points is at most max_points, either by binning them
+    into cubic voxels shown at the mean position of their pores ('voxel')
+    or by random subsampling ('random').  Edges are not shown.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    max_points : int
+        Point budget for the graphic
+    decimate : string
+        Decimation of untouched pores, 'voxel' (default) or 'random'
+    cluster : string
+        Display of the invaded cluster, 'points' (default) for a single
+        point cloud, or 'mesh' for the surface of the cubic voxels that
+        contain the cluster, using at most max_points voxels
+    seed : int
+        Random seed used for random subsampling
+
+    Returns
+    --------
+    fig : plotly Figure
+    """
+    (index, pos, indptr, indices) = _network_arrays(ip)
+    occupy = ip.pores['occupy'].values > 0
+    front = ip.pores['neighbor'].values > 0
+    untouched = np.flatnonzero(~(occupy | front))
+    filled = np.flatnonzero(occupy)
+    data = []
+
+    # Invaded cluster, colored by fill order (initially occupied pores = -1)
+    order = np.full(len(index), -1.0)
+    if len(ip.results) > 0:
+        order[index.get_indexer(ip.results['node'].values)] = np.arange(len(ip.results))
+    if cluster == 'mesh' and len(filled) > 0:
+        (voxel, num_voxels, size) = _voxel_bins(pos[filled], max_points)
+        (xyz, (i, j, k)) = _voxel_surface(pos[filled], size)
+        data.append(plotly.graph_objs.Mesh3d(
+            x=xyz[:,0], y=xyz[:,1], z=xyz[:,2], i=i, j=j, k=k,
+            color='#1f77b4', flatshading=True, hoverinfo='none', name='cluster'))
+        num_cluster = 0
+    else:
+        data.append(plotly.graph_objs.Scatter3d(
+            x=pos[filled,0], y=pos[filled,1], z=pos[filled,2],
+            mode='markers', hoverinfo='none', name='cluster',
+            marker=dict(size=node_size, color=order[filled], colorscale=node_cmap,
+                        showscale=True, line=dict(width=0),
+                        colorbar=dict(thickness=15, title='Iteration'))))
+        num_cluster = len(filled)
+
+    # Invasion front
+    front_pores = np.flatnonzero(front)
+    data.append(plotly.graph_objs.Scatter3d(
+        x=pos[front_pores,0], y=pos[front_pores,1], z=pos[front_pores,2],
+        mode='markers', hoverinfo='none', name='front',
+        marker=dict(size=node_size, color='#d62728', line=dict(width=0))))
+
+    # Untouched pores, decimated to the remaining budget
+    budget = max(max_points - num_cluster - len(front_pores), 0)
+    if len(untouched) <= budget:
+        xyz = pos[untouched]
+    elif budget == 0:
+        xyz = np.zeros((0, 3))
+    elif decimate == 'random':
+        rng = np.random.RandomState(seed)
+        xyz = pos[np.sort(rng.choice(untouched, budget, replace=False))]
+    else:
+        (voxel, num_voxels, size) = _voxel_bins(pos[untouched], budget)
+        count = np.bincount(voxel, minlength=num_voxels)
+        xyz = np.column_stack([np.bincount(voxel, weights=pos[untouched,d],
+                                           minlength=num_voxels)/count for d in range(3)])
+    data.append(plotly.graph_objs.Scatter3d(
+        x=xyz[:,0], y=xyz[:,1], z=xyz[:,2],
+        mode='markers', hoverinfo='none', name='untouched',
+        marker=dict(size=max(node_size-1, 1), color='#bbbbbb', opacity=0.3,
+                    line=dict(width=0))))
+
+    fig = plotly.graph_objs.Figure(data=data, layout=_layout(title))
+    _show(fig, filename, auto_open)
+
+    return fig
+
+def invasion_images(ip, frame_stride=1000, plane='xz', position=0, value='iteration'):
+    """
+    Generate images of a 2D slice of a regular grid as pores are filled
+
+    Images are updated incrementally from the fill order in ip.results, so
+    each frame only sets the pores filled since the previous frame.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model on a regular grid, after run
+    frame_stride : int
+        Number of fills between images
+    plane : string
+        Plane of the slice, 'xz' (default, rows = z, columns = x), 'xy'
+        (rows = y, columns = x), or 'yz' (rows = z, columns = y)
+    position : int
+        Grid index of the slice along the remaining axis
+    value : string
+        Pixel value of filled pores, 'iteration' (default) or 'threshold'.
+        Unfilled pores, and pores occupied before the run, are NaN.
+
+    Yields
+    --------------
+    iteration : int
+        Number of fills shown in the image
+    image : numpy array
+        Image of the slice, for use with matplotlib imshow(image, origin='lower')
+    """
+    axes = {'x': 0, 'y': 1, 'z': 2}
+    (col, row) = [axes[a] for a in plane]
+    normal = 3 - row - col
+    coords = ip.pores[['x', 'y', 'z']].values
+    grid = [np.unique(coords[:,d]) for d in range(3)]
+    ijk = np.column_stack([np.searchsorted(grid[d], coords[:,d]) for d in range(3)])
+    in_plane = ijk[:,normal] == position
+
+    fills = ip.pores.index.get_indexer(ip.results['node'].values)
+    if value == 'threshold':
+        values = ip.results['threshold'].values
+    else:
+        values = np.arange(len(fills))
+    image = np.full((len(grid[row]), len(grid[col])), np.nan)
+    yield 0, image.copy()
+    for start in range(0, len(fills), frame_stride):
+        stop = min(start + frame_stride, len(fills))
+        mask = in_plane[fills[start:stop]]
+        pores = fills[start:stop][mask]
+        image[ijk[pores,row], ijk[pores,col]] = values[start:stop][mask]
+        yield stop, image.copy()
+
+def plot_3d_animation(ip, frame_stride=None, title=None, node_size=3,
+                      node_cmap='Viridis', frame_duration=100, max_frames=100,
+                      filename=None, auto_open=True):
+    """
+    Create a 3D animation of invasion using plotly
+
+    Pores filled between consecutive frames are stored once, as one trace
+    per frame, and each frame only sets which traces are visible.  Each
+    frame lists the visibility of every trace (so the slider can jump to
+    any frame), which grows with the square of the number of frames, so the
+    number of frames is capped at max_frames by raising the frame stride.
+    The size of the output is then bounded by the number of fills plus
+    max_frames squared.  Pores occupied before the run are shown in gray.
+
+    Parameters
+    --------------
+    ip : InvasionPercolation
+        Invasion percolation model, after run
+    frame_stride : int
+        Number of fills between frames, default = None (max_frames frames)
+    frame_duration : int
+        Duration of each frame (ms)
+    max_frames : int
+        Maximum number of frames, default = 100.  If frame_stride gives more
+        frames, the stride is increased.
+
+    Returns
+    --------
+    fig : plotly Figure
+    """
+    (index, pos, indptr, indices) = _network_arrays(ip)
+    fills = index.get_indexer(ip.results['node'].values)
+    min_stride = max(int(np.ceil(len(fills)/float(max(max_frames, 1)))), 1)
+    if frame_stride is None:
+        frame_stride = min_stride
+    frame_stride = max(frame_stride, min_stride)
+    num_frames = int(np.ceil(len(fills)/float(frame_stride)))
+
+    filled = np.zeros(len(index), dtype=bool)
+    filled[fills] = True
+    initial = np.flatnonzero((ip.pores['occupy'].values > 0) & ~filled)
+    data = [plotly.graph_objs.Scatter3d(
+        x=pos[initial,0], y=pos[initial,1], z=pos[initial,2],
+        mode='markers', hoverinfo='none', name='initial',
+        marker=dict(size=node_size, color='#888', line=dict(width=0)))]
+    for k in range(num_frames):
+        pores = fills[k*frame_stride:(k+1)*frame_stride]
+        data.append(plotly.graph_objs.Scatter3d(
+            x=pos[pores,0], y=pos[pores,1], z=pos[pores,2],
+            mode='markers', hoverinfo='none', visible=(k == 0),
+            marker=dict(size=node_size, colorscale=node_cmap,
+                        color=np.arange(k*frame_stride, k*frame_stride + len(pores)),
+                        cmin=0, cmax=max(len(fills)-1, 1), line=dict(width=0))))
+
+    traces = list(range(1, num_frames+1))
+    frames = [plotly.graph_objs.Frame(name=str(k), traces=traces,
+                  data=[dict(visible=(j <= k)) for j in range(num_frames)])
+              for k in range(num_frames)]
+    animation = dict(frame=dict(duration=frame_duration, redraw=True),
+                     mode='immediate', transition=dict(duration=0))
+    steps = [dict(method='animate', label=str(min((k+1)*frame_stride, len(fills))),
+                  args=[[str(k)], animation]) for k in range(num_frames)]
+
+    layout = _layout(title)
+    layout.update(
+        updatemenus=[dict(type='buttons', showactive=False, buttons=[
+            dict(label='Play', method='animate',
+                 args=[None, dict(animation, fromcurrent=True)])])],
+        sliders=[dict(steps=steps, currentvalue=dict(prefix='Iteration: '))])
+
+    fig = plotly.graph_objs.Figure(data=data, layout=layout, frames=frames)
+    _show(fig, filename, auto_open)
+
+    return fig
+
+def _layout(title):
+    """
+    Return the plotly layout used for 3D network graphics
+    """
+    return plotly.graph_objs.Layout(
                     title=title,
                     titlefont=dict(size=16),
-                    showlegend=False, 
+                    showlegend=False,
                     #width=figsize[0],
                     #height=figsize[1],
                     hovermode='closest',
                     margin=dict(b=20,l=5,r=5,t=40),
                     xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
                     yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
-    
-    fig = plotly.graph_objs.Figure(data=data,layout=layout)
+
+def _show(fig, filename=None, auto_open=True):
+    """
+    Write a plotly figure to an html file, and open it if auto_open is True
+    """
     if filename:
-        plotly.offline.plot(fig, filename=filename, auto_open=auto_open)  
+        plotly.offline.plot(fig, filename=filename, auto_open=auto_open)
     else:
-        plotly.offline.plot(fig, auto_open=auto_open)  
+        plotly.offline.plot(fig, auto_open=auto_open)
 
-    
@@ -1,7 +1,1261 @@
 import networkx as nx
 import pandas as pd
 import numpy as np
+import heapq
 import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_pore_columns = ['id', 'x', 'y', 'z', 'radius', 'grain']
+_pore_dtypes = {'id': np.int64, 'x': np.float64, 'y': np.float64, 'z': np.float64, 
+                'radius': np.float64, 'grain': np.int64}
+
+def _count_lines(filename):
+    """
+    Count the lines of a text file, reading it in 1 MB blocks
+    """
+    count = 0
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            count += block.count(b'\n')
+    
+    return count + 1 # last line without a newline
+
+def _read_pore_file(pore_file, chunksize=None):
+    """
+    Read a pore file (8 header lines, then id, x, y, z, radius, grain) into 
+    a DataFrame indexed by pore id.  If chunksize is given, the file is 
+    parsed chunksize rows at a time and each chunk is copied into column 
+    arrays preallocated from the number of lines, so peak memory is the 
+    size of the frame plus one chunk.
+    """
+    reader = pd.read_csv(pore_file, sep=r'\s+', skiprows=8, header=None, 
+                         names=_pore_columns, dtype=_pore_dtypes, 
+                         engine='c', chunksize=chunksize)
+    if chunksize:
+        columns = ['x', 'y', 'z', 'radius']
+        capacity = max(_count_lines(pore_file) - 8, 0)
+        ids = np.empty(capacity, dtype=np.int64)
+        grain = np.empty(capacity, dtype=np.int64)
+        block = np.empty((len(columns), capacity)) # one row per column
+        start = 0
+        for chunk in reader:
+            stop = start + len(chunk)
+            ids[start:stop] = chunk['id'].values
+            grain[start:stop] = chunk['grain'].values
+            block[:,start:stop] = chunk[columns].values.T
+            start = stop
+        pores = pd.DataFrame(block[:,:start].T, columns=columns, 
+                             index=pd.Index(ids[:start], name='id'))
+        pores['grain'] = grain[:start]
+    else:
+        pores = reader
+        pores.set_index('id', inplace=True)
+    
+    if not pores.index.is_unique:
+        raise ValueError('Pore file contains duplicate pore ids')
+    if (pores['radius'] < 0).any():
+        raise ValueError('Pore file contains negative radius values')
+    
+    return pores
+
+def _read_throat_file(throat_file, pore_index, chunksize=None):
+    """
+    Read a throat file (5 header lines, then id, start pore id, end pore id) 
+    and return the start and end pore positions in pore_index.  If 
+    chunksize is given, the file is parsed chunksize rows at a time and only 
+    the int32 positions of each chunk are kept.
+    """
+    reader = pd.read_csv(throat_file, sep=r'\s+', skiprows=5, header=None, 
+                         usecols=[1, 2], names=['id', 'start', 'end'], 
+                         dtype=np.int64, engine='c', chunksize=chunksize)
+    if not chunksize:
+        reader = [reader]
+    
+    src = []
+    dst = []
+    for throats in reader:
+        start = pore_index.get_indexer(throats['start'].values)
+        end = pore_index.get_indexer(throats['end'].values)
+        missing = (start < 0) | (end < 0)
+        if missing.any():
+            raise ValueError('Throat file references ' + str(missing.sum()) + 
+                             ' pore ids that are not in the pore file')
+        src.append(start.astype(np.int32))
+        dst.append(end.astype(np.int32))
+    
+    if len(src) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(src), np.concatenate(dst)
+
+def _csr_from_edges(src, dst, N):
+    """
+    Build a compressed sparse row (CSR) adjacency from undirected edges.
+    
+    Parameters
+    --------------
+    src : numpy array
+        Start pore position (zero based) of each edge
+    dst : numpy array
+        End pore position (zero based) of each edge
+    N : int
+        Number of pores
+    
+    Returns
+    --------
+    indptr : numpy array of int32
+        Neighbors of pore i are stored in indices[indptr[i]:indptr[i+1]]
+    indices : numpy array of int32
+        Neighbor pore positions, sorted within each pore
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    # Store each edge in both directions and remove duplicates
+    edges = np.unique(np.concatenate([src + N*dst, dst + N*src]))
+    rows = edges // N
+    cols = edges % N
+    indptr = np.zeros(N+1, dtype=np.int32)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=N))
+    indices = cols.astype(np.int32)
+    
+    return indptr, indices
+
+def _grid_adjacency(Nx, Ny, Nz):
+    """
+    Build the CSR adjacency of a regular Nx by Ny by Nz grid, where pore 
+    i + Nx*(j + Ny*k) is connected to its face neighbors.
+    """
+    N = Nx*Ny*Nz
+    ids = np.arange(N)
+    i = ids % Nx
+    j = (ids // Nx) % Ny
+    k = ids // (Nx*Ny)
+    # Neighbor offsets in increasing order, and where they exist
+    offsets = [-Nx*Ny, -Nx, -1, 1, Nx, Nx*Ny]
+    valid = [k > 0, j > 0, i > 0, i < Nx-1, j < Ny-1, k < Nz-1]
+    
+    indptr = np.zeros(N+1, dtype=np.int32)
+    indptr[1:] = np.cumsum(np.sum(valid, axis=0))
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    slot = indptr[:-1].copy()
+    for offset, mask in zip(offsets, valid):
+        rows = np.flatnonzero(mask)
+        indices[slot[rows]] = rows + offset
+        slot[rows] += 1
+    
+    return indptr, indices
+
+def _csr_gather(indptr, indices, rows):
+    """
+    Return the concatenated neighbors of pore positions in rows
+    """
+    starts = indptr[rows]
+    counts = indptr[np.asarray(rows)+1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    
+    return indices[offsets + np.arange(counts.sum())]
+
+def _components(indptr, indices, mask, group=None):
+    """
+    Label connected components of the pores in mask, using edges between 
+    masked pores (in the same group, if given).  The label of each pore is 
+    the smallest pore position in its component (pores outside of mask are 
+    their own label).  In each pass, the root of the larger label of every 
+    edge between components is hooked to the smaller label, labels are 
+    compressed by pointer jumping, and edges inside one component are 
+    dropped, so the number of passes grows with the log of the number of 
+    pores.
+    """
+    N = len(indptr) - 1
+    rows = np.repeat(np.arange(N), np.diff(indptr))
+    keep = (rows < indices) & mask[rows] & mask[indices]
+    if group is not None:
+        keep = keep & (group[rows] == group[indices])
+    (src, dst) = (rows[keep], np.asarray(indices)[keep].astype(np.int64))
+    
+    labels = np.arange(N)
+    while len(src) > 0:
+        (a, b) = (labels[src], labels[dst])
+        cross = a != b
+        (src, dst, a, b) = (src[cross], dst[cross], a[cross], b[cross])
+        if len(src) == 0:
+            break
+        np.minimum.at(labels, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    
+    return labels
+
+def _undo_fills(parent, outlet, node, defender, indptr, indices, end, trapped_fill):
+    """
+    Undo fills in reverse order using the union-find forest parent, and flag 
+    fills whose pore was cut off from the outlet in trapped_fill.  A filled 
+    pore is its own root until its fill is undone, when the clusters of its 
+    defending neighbors (and the outlet, for end pores) are merged into it.  
+    The outlet is always kept as a root.  Compiled by _compiled_undo_fills 
+    when numba is installed.
+    """
+    for t in range(len(node)-1, -1, -1):
+        v = node[t]
+        defender[v] = True
+        root = v
+        for e in range(indptr[v], indptr[v+1]):
+            n = indices[e]
+            if not defender[n]:
+                continue
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            if n == root:
+                continue
+            if n == outlet:
+                parent[root] = outlet
+                root = outlet
+            else:
+                parent[n] = root
+        if end[v] and (root != outlet):
+            parent[root] = outlet
+            root = outlet
+        if root != outlet:
+            trapped_fill[t] = True
+
+def _read_only(values):
+    """
+    Return a read-only view of values
+    """
+    values = np.asarray(values).view()
+    values.flags.writeable = False
+    return values
+
+class PoreNetwork(object):
+    """
+    Read-only pore network geometry and CSR adjacency.  A PoreNetwork holds 
+    no simulation state, so one network can be shared by many runs, 
+    including runs in separate threads.
+    
+    Parameters
+    --------------
+    index : pandas Index
+        Pore ids, in pore position order
+    x, y, z : numpy array
+        Pore location (m)
+    radius : numpy array
+        Pore radius (m)
+    grain : numpy array
+        Pore grain type (zero based index)
+    indptr : numpy array of int32
+        Neighbors of pore i are stored in indices[indptr[i]:indptr[i+1]]
+    indices : numpy array of int32
+        Neighbor pore positions
+    """
+    
+    def __init__(self, index, x, y, z, radius, grain, indptr, indices):
+        self.index = index
+        self.x = _read_only(x)
+        self.y = _read_only(y)
+        self.z = _read_only(z)
+        self.radius = _read_only(radius)
+        self.grain = _read_only(grain)
+        self.indptr = _read_only(indptr)
+        self.indices = _read_only(indices)
+    
+    @property
+    def num_pores(self):
+        """
+        Number of pores
+        """
+        return len(self.indptr) - 1
+    
+    @property
+    def degree(self):
+        """
+        Number of neighbors of each pore (connectivity)
+        """
+        return np.diff(self.indptr)
+    
+    def neighbors(self, i):
+        """
+        Neighbor positions of the pore at position i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+class SimulationState(object):
+    """
+    Mutable state of one invasion percolation run on a PoreNetwork.  All 
+    arrays are allocated once and indexed by pore position, so the state 
+    can be reset and reused for many runs without reallocation.
+    
+    Parameters
+    --------------
+    num_pores : int
+        Number of pores in the network
+    
+    Attributes
+    ------------
+    occupy : numpy array of bool
+        Pores occupied by the invading fluid
+    front : numpy array of bool
+        Pores along the invading/defending interface (neighbors)
+    order : numpy array of int32
+        Iteration at which each pore was filled, -1 if not filled by the run
+    threshold : numpy array of float
+        Total pressure at which each pore was filled, NaN if not filled by the run
+    trapped : numpy array of bool
+        Pores of defending fluid that are trapped (see apply_trapping)
+    pt : numpy array of float
+        Effective total pressure (Pa) of each pore, which differs from the 
+        input pressure only with facilitation
+    random_state : numpy RandomState
+        Random number generator used when p > 0, created by invade
+    fill_node, fill_threshold : numpy array of int32, numpy array of float
+        Filled pore positions and thresholds, in fill order.  Only the first 
+        iterations values are used.  The arrays grow geometrically as the 
+        run progresses.
+    iterations : int
+        Number of pores filled by the run
+    """
+    
+    def __init__(self, num_pores):
+        self.occupy = np.zeros(num_pores, dtype=bool)
+        self.front = np.zeros(num_pores, dtype=bool)
+        self.order = np.full(num_pores, -1, dtype=np.int32)
+        self.threshold = np.full(num_pores, np.nan)
+        self.trapped = np.zeros(num_pores, dtype=bool)
+        self.pt = np.full(num_pores, np.nan)
+        self.random_state = None
+        self.fill_node = np.empty(min(num_pores, 1024), dtype=np.int32)
+        self.fill_threshold = np.empty(min(num_pores, 1024))
+        self.iterations = 0
+    
+    def reset(self, occupy):
+        """
+        Reset the state in place
+        
+        Parameters
+        --------------
+        occupy : numpy array of bool
+            Initially occupied pores
+        """
+        self.occupy[:] = occupy
+        self.front[:] = False
+        self.order[:] = -1
+        self.threshold[:] = np.nan
+        self.trapped[:] = False
+        self.random_state = None
+        self.iterations = 0
+    
+    def update_front(self, network):
+        """
+        Recompute the front from the occupied pores
+        """
+        neigh = _csr_gather(network.indptr, network.indices, np.flatnonzero(self.occupy))
+        self.front[:] = False
+        self.front[neigh] = True
+        self.front[self.occupy] = False
+    
+    def grow(self, size):
+        """
+        Grow fill_node and fill_threshold geometrically to hold at least 
+        size fills
+        """
+        capacity = max(len(self.fill_node), 1)
+        if size <= len(self.fill_node):
+            return
+        while capacity < size:
+            capacity = 2*capacity
+        for name in ['fill_node', 'fill_threshold']:
+            values = getattr(self, name)
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+    
+    def fill_order(self):
+        """
+        Return the filled pore positions and thresholds, in fill order
+        """
+        return (self.fill_node[:self.iterations].copy(), 
+                self.fill_threshold[:self.iterations].copy())
+    
+    def apply_trapping(self, network, end):
+        """
+        Remove fills of pores whose defending fluid was trapped, that is, 
+        cut off from the end pores when the pore was filled, and mark 
+        trapped defending fluid.
+        
+        Trapping is identified in one pass backwards through the fill order 
+        using union-find: defending fluid clusters are merged as fills are 
+        undone, so a fill is trapped if the pore's cluster at that time does 
+        not contain an end pore.  Defending fluid clusters at the end of the 
+        run are labeled with vectorized operations (see _components), and 
+        the pass over the fills is compiled when numba is installed.  The 
+        result is exact for deterministic (p = 0) invasion, where trapping 
+        does not change the order in which untrapped pores are filled.
+        
+        Parameters
+        --------------
+        network : PoreNetwork
+            Pore network
+        end : numpy array of bool
+            End pores, which connect the defending fluid to the outlet
+        """
+        N = network.num_pores
+        indptr = network.indptr
+        indices = network.indices
+        (node, thresh) = self.fill_order()
+        
+        # Defending fluid clusters at the end of the run, as a forest of 
+        # depth one, with clusters that contain an end pore under the outlet
+        defender = ~self.occupy
+        labels = _components(indptr, indices, defender)
+        outlet = N
+        parent = np.append(labels, outlet)
+        parent[labels[defender & end]] = outlet
+        trapped = defender & (parent[labels] != outlet)
+        
+        # Undo fills in reverse order
+        trapped_fill = np.zeros(len(node), dtype=bool)
+        undo_fills = _compiled_undo_fills()
+        if undo_fills is None:
+            undo_fills = _undo_fills
+            parent = parent.tolist()
+        undo_fills(parent, outlet, node.astype(np.int64), defender, indptr, indices, 
+                   np.asarray(end, dtype=bool), trapped_fill)
+        
+        removed = node[trapped_fill]
+        kept = node[~trapped_fill]
+        self.occupy[removed] = False
+        self.order[removed] = -1
+        self.threshold[removed] = np.nan
+        self.order[kept] = np.arange(len(kept))
+        self.fill_node[:len(kept)] = kept
+        self.fill_threshold[:len(kept)] = thresh[~trapped_fill]
+        self.trapped[:] = trapped
+        self.trapped[removed] = True
+        self.iterations = len(kept)
+        self.update_front(network)
+        self.front[self.trapped] = False
+
+class RunStats(object):
+    """
+    Run statistics, recorded by InvasionPercolation.run when profile is 
+    True or a progress function is given
+    
+    Attributes
+    --------------
+    phase_time : dict
+        Cumulative time (s) of each phase of the invasion loop, recorded when 
+        profile is True.  Phases are 'stop_criteria', 'select', 
+        'update_neighbors', and 'facilitation' ('kernel' for the numba engine).
+    calls : dict
+        Number of calls of each phase
+    iterations : int
+        Number of fills in the run
+    elapsed : float
+        Wall-clock time (s) of the run
+    """
+    
+    def __init__(self):
+        self.phase_time = {}
+        self.calls = {}
+        self.iterations = 0
+        self.elapsed = 0.0
+        self._samples = []
+        self._start_iteration = 0
+        self._start_time = time.perf_counter()
+    
+    def add(self, phase, seconds):
+        """
+        Add the time of one call of a phase
+        """
+        self.phase_time[phase] = self.phase_time.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+    
+    def sample(self, iterations, front_size):
+        """
+        Record the number of fills and the front size, after each batch
+        """
+        self.iterations = iterations - self._start_iteration
+        self.elapsed = time.perf_counter() - self._start_time
+        self._samples.append((iterations, front_size, self.elapsed))
+    
+    @property
+    def front(self):
+        """
+        DataFrame of the iteration, front size, and elapsed time (s) after 
+        each batch
+        """
+        return pd.DataFrame(self._samples, columns=['iteration', 'front_size', 'elapsed'])
+    
+    @property
+    def fills_per_second(self):
+        """
+        Average number of fills per second
+        """
+        if self.elapsed > 0:
+            return self.iterations/self.elapsed
+        return np.nan
+
+class _StopCriteria(object):
+    """
+    Stop criteria, updated as each pore is filled so every check is O(1)
+    """
+    
+    def __init__(self, end, occupy, max_iterations=-1, n_outlets=1, 
+                 max_saturation=None, max_pressure=None, time_limit=None):
+        self.end = end
+        self.max_iterations = max_iterations
+        self.n_outlets = n_outlets
+        self.max_occupied = np.inf if max_saturation is None else max_saturation*len(occupy)
+        self.max_pressure = np.inf if max_pressure is None else max_pressure
+        self.time_limit = time_limit
+        self.start_time = time.time()
+        
+        self.outlets = int(np.sum(end & occupy))
+        self.occupied = int(np.sum(occupy))
+        self.threshold = -np.inf
+    
+    def update(self, fill, threshold):
+        """
+        Update the criteria with the pore position and threshold of a fill
+        """
+        if self.end[fill]:
+            self.outlets += 1
+        self.occupied += 1
+        self.threshold = threshold
+    
+    def stop(self, i):
+        """
+        Return True if the run should stop before iteration i
+        """
+        if self.outlets >= self.n_outlets:
+            return True
+        if (self.max_iterations > 0) and (i > self.max_iterations):
+            return True
+        if self.occupied >= self.max_occupied:
+            return True
+        if self.threshold > self.max_pressure:
+            return True
+        if (self.time_limit is not None) and (time.time() - self.start_time > self.time_limit):
+            return True
+        return False
+
+def _facilitation_multiplier(n, nf):
+    """
+    Radius multiplier for a front pore with n filled neighbors out of nf, 
+    2 - (n-1)/(nf-1), which is 2 for one filled neighbor and 1 when all 
+    neighbors are filled
+    """
+    n = np.asarray(n, dtype=float)
+    nf = np.asarray(nf, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        multiplier = 2-((n/nf-1/nf)/(1-1/nf))
+    
+    return np.where(nf > 1, multiplier, 1.0)
+
+class _HeapFront(object):
+    """
+    Invasion front as a binary heap keyed on (total pressure, pore position).  
+    When the pressure of a front pore changes, a new entry is pushed and the 
+    old entry is skipped when popped.  Pores with a NaN total pressure are 
+    never pushed, as they are skipped by the pandas engine.
+    
+    With flood = True, pores pushed at or below the running maximum of the 
+    popped pressures (level) are kept in a first-in first-out queue and 
+    popped before the heap, without heap operations (priority-flood).  This 
+    fills the same pores below each level, in a different order.
+    """
+    
+    def __init__(self, pt, front, flood=False, level=-np.inf):
+        self.pt = pt
+        self.front = front
+        self.heap = [(pt[n], n) for n in np.flatnonzero(front & ~np.isnan(pt))]
+        heapq.heapify(self.heap)
+        self.size = len(self.heap)
+        self.flood = [] if flood else None
+        self.flood_start = 0
+        self.level = level
+    
+    def __len__(self):
+        return self.size
+    
+    def push(self, n):
+        if np.isnan(self.pt[n]):
+            return
+        if (self.flood is not None) and (self.pt[n] <= self.level):
+            self.flood.append(n)
+        else:
+            heapq.heappush(self.heap, (self.pt[n], n))
+        self.size += 1
+    
+    def update(self, n):
+        if not np.isnan(self.pt[n]):
+            heapq.heappush(self.heap, (self.pt[n], n))
+    
+    def pop(self):
+        """
+        Remove and return the pore position with the lowest total pressure, 
+        or the next flooded pore
+        """
+        if (self.flood is not None) and (self.flood_start < len(self.flood)):
+            n = self.flood[self.flood_start]
+            self.flood_start += 1
+            self.size -= 1
+            return n
+        while True:
+            (key, n) = heapq.heappop(self.heap)
+            if self.front[n] and not (key < self.pt[n] or key > self.pt[n]):
+                self.size -= 1
+                if key > self.level:
+                    self.level = key
+                return n
+
+class _RankedFront(object):
+    """
+    Invasion front as an order-statistic set over slots ranked by (total 
+    pressure, pore position), stored in a Fenwick (binary indexed) tree so 
+    that inserting a pore and removing the k-th smallest are O(log N).
+    
+    Without facilitation each pore has one slot.  With facilitation, pore i 
+    has one slot for each possible number of filled neighbors n, at 
+    indptr[i] + n - 1, so a change in pressure moves the pore between slots 
+    that are ranked in advance.  Pores with a NaN total pressure are not 
+    added, as they are skipped by the pandas engine.
+    """
+    
+    def __init__(self, pt, front, slot_pt=None, indptr=None, nfill=None):
+        N = len(pt)
+        self.pt = pt
+        if slot_pt is None:
+            slot_pt = pt
+            self.owner = np.arange(N)
+        else:
+            self.owner = np.repeat(np.arange(N), np.diff(indptr))
+        self.indptr = indptr
+        self.nfill = nfill
+        self.current = np.zeros(N, dtype=np.int64) # slot of each front pore
+        
+        M = len(slot_pt)
+        self.order = np.lexsort((self.owner, slot_pt)) # rank to slot
+        self.rank = np.empty(M, dtype=np.int64) # slot to rank
+        self.rank[self.order] = np.arange(M)
+        
+        # Build the tree in O(M), tree[r] = count over ranks (r - lowbit(r), r]
+        front_pores = np.flatnonzero(front & ~np.isnan(pt))
+        self.current[front_pores] = self._slot(front_pores)
+        occupied = np.zeros(M, dtype=bool)
+        occupied[self.current[front_pores]] = True
+        count = np.zeros(M+1, dtype=np.int64)
+        count[1:] = np.cumsum(occupied[self.order])
+        r = np.arange(1, M+1)
+        tree = np.zeros(M+1, dtype=np.int64)
+        tree[1:] = count[r] - count[r - (r & -r)]
+        self.tree = tree.tolist()
+        self.size = int(count[-1])
+        self.M = M
+        self.top_bit = 1 << (M.bit_length()-1) if M > 0 else 0
+    
+    def __len__(self):
+        return self.size
+    
+    def _slot(self, n):
+        if self.indptr is None:
+            return n
+        return self.indptr[n] + self.nfill[n] - 1
+    
+    def _add(self, slot, value):
+        r = int(self.rank[slot]) + 1
+        tree = self.tree
+        while r <= self.M:
+            tree[r] += value
+            r += r & -r
+        self.size += value
+    
+    def push(self, n):
+        if np.isnan(self.pt[n]):
+            return
+        self.current[n] = self._slot(n)
+        self._add(self.current[n], 1)
+    
+    def update(self, n):
+        if np.isnan(self.pt[n]):
+            return
+        self._add(self.current[n], -1)
+        self.push(n)
+    
+    def pop(self, k):
+        """
+        Remove and return the pore position with the k-th (zero based) 
+        smallest total pressure
+        """
+        tree = self.tree
+        r = 0
+        k = k + 1
+        bit = self.top_bit
+        while bit:
+            if (r + bit <= self.M) and (tree[r + bit] < k):
+                r += bit
+                k -= tree[r]
+            bit >>= 1
+        slot = int(self.order[r])
+        self._add(slot, -1)
+        
+        return int(self.owner[slot])
+
+def _invade_kernel(indptr, indices, end, occupy, front, pt, order, threshold, 
+                   fill_node, fill_threshold, i, stop_i, heap_key, heap_node, 
+                   tree, rank, rank_order, owner, current, top_bit, size, draws, c, 
+                   facilitation, base, pc, nf, nfill, counts, last, n_outlets, 
+                   max_iterations, max_occupied, max_pressure, flood, flood_queue, 
+                   flood_pos):
+    """
+    Invasion loop over NumPy arrays, compiled by _compiled_kernel.  Fills 
+    pores from iteration i until iteration stop_i, the front is empty, or a 
+    stop criterion is met, and returns (i, stopped).
+    
+    The front is a binary heap of (key, pore) in heap_key and heap_node when 
+    p = 0 (draws is empty), or a Fenwick tree over ranked slots when p > 0 
+    (one draw per fill), as in _HeapFront and _RankedFront.  size holds the 
+    number of front pores and the number of heap entries, counts holds the 
+    number of occupied end pores and occupied pores, and last holds the 
+    threshold of the last fill and the running maximum threshold.  With 
+    flood, pores pushed at or below the running maximum are queued in 
+    flood_queue from flood_pos[0] to flood_pos[1], as in _HeapFront.  Pores 
+    with a NaN total pressure join the front but are never filled.
+    """
+    stochastic = len(draws) > 0
+    M = len(rank)
+    i_start = i
+    while size[0] > 0:
+        if (counts[0] >= n_outlets) or ((max_iterations > 0) and (i > max_iterations)) or \
+           (counts[1] >= max_occupied) or (last[0] > max_pressure):
+            return i, True
+        if i == stop_i:
+            return i, False
+        
+        if stochastic:
+            rc = draws[i - i_start]**c
+            k = int(np.ceil(rc*size[0]))
+            if k == size[0]:
+                k = k - 1 # zero based index
+            # Find the rank of the k-th occupied slot and remove it
+            r = 0
+            k = k + 1
+            bit = top_bit
+            while bit:
+                if (r + bit <= M) and (tree[r + bit] < k):
+                    r += bit
+                    k -= tree[r]
+                bit >>= 1
+            slot = rank_order[r]
+            r = rank[slot] + 1
+            while r <= M:
+                tree[r] -= 1
+                r += r & -r
+            fill = owner[slot]
+        elif flood and (flood_pos[0] < flood_pos[1]):
+            fill = flood_queue[flood_pos[0]]
+            flood_pos[0] += 1
+        else:
+            # Pop heap entries until one is current
+            while True:
+                key = heap_key[0]
+                fill = heap_node[0]
+                size[1] -= 1
+                m = size[1]
+                last_key = heap_key[m]
+                last_node = heap_node[m]
+                j = 0
+                while True:
+                    child = 2*j + 1
+                    if child >= m:
+                        break
+                    if (child + 1 < m) and ((heap_key[child+1] < heap_key[child]) or \
+                       ((heap_key[child+1] == heap_key[child]) and (heap_node[child+1] < heap_node[child]))):
+                        child += 1
+                    if (last_key < heap_key[child]) or \
+                       ((last_key == heap_key[child]) and (last_node < heap_node[child])):
+                        break
+                    heap_key[j] = heap_key[child]
+                    heap_node[j] = heap_node[child]
+                    j = child
+                heap_key[j] = last_key
+                heap_node[j] = last_node
+                if front[fill] and not (key < pt[fill] or key > pt[fill]):
+                    break
+            if key > last[1]:
+                last[1] = key
+        size[0] -= 1
+        value = pt[fill]
+        
+        occupy[fill] = True
+        front[fill] = False
+        if end[fill]:
+            counts[0] += 1
+        counts[1] += 1
+        last[0] = value
+        
+        for e in range(indptr[fill], indptr[fill+1]):
+            n = indices[e]
+            if occupy[n] or (front[n] and not facilitation):
+                continue
+            if facilitation:
+                nfill[n] += 1
+                if nf[n] > 1:
+                    a = float(nfill[n])
+                    b = float(nf[n])
+                    pt[n] = base[n] + pc[n]/(2-((a/b-1/b)/(1-1/b)))
+                else:
+                    pt[n] = base[n] + pc[n]
+            if np.isnan(pt[n]):
+                front[n] = True
+                continue
+            if front[n]:
+                size[0] -= 1
+                if stochastic:
+                    r = rank[current[n]] + 1
+                    while r <= M:
+                        tree[r] -= 1
+                        r += r & -r
+            else:
+                front[n] = True
+            size[0] += 1
+            
+            if stochastic:
+                if facilitation:
+                    current[n] = indptr[n] + nfill[n] - 1
+                else:
+                    current[n] = n
+                r = rank[current[n]] + 1
+                while r <= M:
+                    tree[r] += 1
+                    r += r & -r
+            elif flood and (pt[n] <= last[1]):
+                flood_queue[flood_pos[1]] = n
+                flood_pos[1] += 1
+            else:
+                j = size[1]
+                size[1] += 1
+                key = pt[n]
+                while j > 0:
+                    parent = (j - 1) >> 1
+                    if (heap_key[parent] < key) or \
+                       ((heap_key[parent] == key) and (heap_node[parent] < n)):
+                        break
+                    heap_key[j] = heap_key[parent]
+                    heap_node[j] = heap_node[parent]
+                    j = parent
+                heap_key[j] = key
+                heap_node[j] = n
+        
+        fill_node[i] = fill
+        fill_threshold[i] = value
+        order[fill] = i
+        threshold[fill] = value
+        i += 1
+    
+    return i, True
+
+def _compiled_kernel():
+    """
+    Return _invade_kernel compiled with numba, or None if numba is not 
+    installed
+    """
+    global _invade_kernel_compiled
+    if numba is None:
+        return None
+    if _invade_kernel_compiled is None:
+        _invade_kernel_compiled = numba.njit(nogil=True, cache=True)(_invade_kernel)
+    return _invade_kernel_compiled
+
+_invade_kernel_compiled = None
+
+def _compiled_undo_fills():
+    """
+    Return _undo_fills compiled with numba, or None if numba is not 
+    installed
+    """
+    global _undo_fills_compiled
+    if numba is None:
+        return None
+    if _undo_fills_compiled is None:
+        _undo_fills_compiled = numba.njit(nogil=True, cache=True)(_undo_fills)
+    return _undo_fills_compiled
+
+_undo_fills_compiled = None
+
+def _save_checkpoint(filename, state, pt, pc, end, params):
+    """
+    Save a SimulationState and the inputs needed to resume invade to a 
+    compressed .npz file.  The file is written to a temporary name and then 
+    renamed, so an interrupted write does not corrupt an earlier checkpoint.
+    """
+    (node, thresh) = state.fill_order()
+    data = {'occupy': np.packbits(state.occupy), 
+            'node': node, 
+            'threshold': thresh, 
+            'pt': pt, 
+            'end': np.packbits(end), 
+            'params': np.array(json.dumps(params, default=lambda v: v.item()))} # NumPy scalars
+    if pc is not None:
+        data['pc'] = pc
+    if state.random_state is not None:
+        (name, keys, pos, has_gauss, cached_gaussian) = state.random_state.get_state()
+        data['rng_keys'] = keys
+        data['rng_state'] = np.array([pos, has_gauss, cached_gaussian])
+    
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.savez_compressed(f, **data)
+    os.replace(tmp_filename, filename)
+
+def _load_checkpoint(filename, network):
+    """
+    Load a checkpoint saved by invade and return the SimulationState and 
+    the keyword arguments to resume invade
+    """
+    N = network.num_pores
+    data = np.load(filename)
+    params = json.loads(str(data['params']))
+    
+    state = SimulationState(N)
+    state.reset(np.unpackbits(data['occupy'])[:N].astype(bool))
+    node = data['node']
+    state.order[node] = np.arange(len(node))
+    state.threshold[node] = data['threshold']
+    state.grow(len(node))
+    state.fill_node[:len(node)] = node
+    state.fill_threshold[:len(node)] = data['threshold']
+    state.iterations = len(node)
+    if 'rng_keys' in data:
+        (pos, has_gauss, cached_gaussian) = data['rng_state']
+        state.random_state = np.random.RandomState()
+        state.random_state.set_state(('MT19937', data['rng_keys'], int(pos), 
+                                      int(has_gauss), float(cached_gaussian)))
+    
+    kwds = dict(params)
+    kwds['pt'] = data['pt']
+    kwds['end'] = np.unpackbits(data['end'])[:N].astype(bool)
+    kwds['pc'] = data['pc'] if 'pc' in data else None
+    
+    return state, kwds
+
+def invade(network, pt, end, state, max_iterations=-1, p=0, seed=0, trapping=False, 
+           facilitation=False, pc=None, checkpoint=None, checkpoint_interval=100000, 
+           callback=None, batch_size=10000, compiled=False, stats=None, flood=False, 
+           **kwds):
+    """
+    Run invasion percolation, filling one pore along the front at each 
+    iteration until an end pore is occupied or max_iterations is exceeded.
+    
+    When p = 0, the front pore with the lowest total pressure is filled.  The 
+    front is kept in a binary heap and only pores newly exposed by the 
+    previous fill are pushed, so each iteration is O(log N).  Ties are broken 
+    by pore position.  When p > 0, the front is kept in an order-statistic 
+    tree and the pore at rank ceil(rand()^(1/p)*len(front)) is filled, which 
+    is also O(log N) and uses the same random sequence as the pandas engine.
+    The network is not modified.  Additional stop criteria are checked in 
+    O(1) per iteration.
+    
+    With facilitation, the capillary pressure of a front pore is divided by 
+    a radius multiplier based on its number of filled neighbors (see 
+    InvasionPercolation.run).  Only the unfilled neighbors of the filled pore 
+    are updated and re-keyed at each iteration.
+    
+    Parameters
+    --------------
+    network : PoreNetwork
+        Pore network
+    pt : numpy array
+        Total pressure (Pa) of each pore
+    end : numpy array of bool
+        End pores
+    state : SimulationState
+        Initial occupancy, updated in place
+    max_iterations : int
+        Maximum number of iteration, -1 = run to completion
+    p : float
+        Stochastic process parameter, between 0 and 1
+    seed : int
+        Random seed used in the stochastic process
+    trapping : bool
+        If True, remove fills of pores whose defending fluid was trapped, 
+        see SimulationState.apply_trapping.  Requires p = 0.
+    facilitation : bool
+        If True, adjust the pressure of front pores based on the number of 
+        filled neighbors.  The effective total pressure is stored in state.pt.
+    pc : numpy array
+        Capillary pressure (Pa) of each pore, required for facilitation
+    checkpoint : string
+        Name of a checkpoint file, written every checkpoint_interval 
+        iterations, default = None (no checkpoints).  The run can be 
+        continued from the checkpoint using InvasionPercolation.resume.
+    checkpoint_interval : int
+        Number of iterations between checkpoints
+    callback : function
+        Function called as callback(iteration, node, threshold) with arrays 
+        of the iteration, filled pore position, and threshold of each batch 
+        of batch_size fills, as the run progresses.  Fills later removed by 
+        trapping are included.
+    batch_size : int
+        Number of fills per callback
+    compiled : bool
+        If True and numba is installed, run the invasion loop in a compiled 
+        kernel over the network arrays (see _invade_kernel), which gives the 
+        same results.  The time limit is then checked after each batch.
+    stats : RunStats
+        If given, the time of each phase of the loop is added to stats
+    flood : bool
+        If True (p = 0 without facilitation), front pores at or below the 
+        running maximum threshold are filled in first-in first-out order 
+        without heap operations (priority-flood).  The same pores are filled 
+        below each running maximum, but in a different order.
+    kwds : 
+        Additional stop criteria (n_outlets, max_saturation, max_pressure, 
+        time_limit), see InvasionPercolation.run
+    """
+    batches = _iter_invade(network, pt, end, state, max_iterations, p, seed, trapping, 
+                           facilitation, pc, checkpoint, checkpoint_interval, 
+                           batch_size, compiled, stats, flood, **kwds)
+    for (start, stop) in batches:
+        if callback is not None:
+            callback(np.arange(start, stop), state.fill_node[start:stop], 
+                     state.fill_threshold[start:stop])
+
+def _iter_invade(network, pt, end, state, max_iterations, p, seed, trapping, 
+                 facilitation, pc, checkpoint, checkpoint_interval, batch_size, 
+                 compiled=False, stats=None, flood=False, **kwds):
+    """
+    Generator that runs invade and yields the (start, stop) iterations of 
+    each batch of batch_size fills, see invade
+    """
+    indptr = network.indptr
+    indices = network.indices
+    occupy = state.occupy
+    front = state.front
+    
+    params = dict(kwds, max_iterations=max_iterations, p=p, seed=seed, 
+                  trapping=trapping, facilitation=facilitation, 
+                  checkpoint_interval=checkpoint_interval, compiled=compiled, 
+                  flood=flood)
+    compiled = compiled and (numba is not None)
+    pt_input = pt
+    
+    state.update_front(network)
+    state.pt[:] = pt
+    pt = state.pt
+    if facilitation:
+        nf = network.degree
+        base = pt_input - pc
+        rows = np.repeat(np.arange(network.num_pores), nf)
+        nfill = np.bincount(rows, weights=occupy[indices], 
+                            minlength=network.num_pores).astype(np.int64)
+        aff = np.flatnonzero(front)
+        pt[aff] = base[aff] + pc[aff]/_facilitation_multiplier(nfill[aff], nf[aff])
+        filled = state.order >= 0
+        pt[filled] = state.threshold[filled]
+    
+    if p > 0:
+        if facilitation:
+            slot_n = np.arange(len(indices)) - indptr[rows] + 1
+            slot_pt = base[rows] + pc[rows]/_facilitation_multiplier(slot_n, nf[rows])
+            queue = _RankedFront(pt, front, slot_pt, indptr, nfill)
+        else:
+            queue = _RankedFront(pt, front)
+        if (state.random_state is None) or (state.iterations == 0):
+            state.random_state = np.random.RandomState(seed)
+        rng = state.random_state
+        c = 1/p
+    elif compiled:
+        queue = None
+    else:
+        level = np.max(state.fill_threshold[:state.iterations], initial=-np.inf)
+        queue = _HeapFront(pt, front, flood, level)
+    criteria = _StopCriteria(end, occupy, max_iterations, **kwds)
+    if state.iterations > 0:
+        criteria.threshold = state.fill_threshold[state.iterations-1]
+    
+    if compiled:
+        if not facilitation:
+            (base, nf, nfill) = (np.empty(0), np.empty(0, dtype=np.int64), 
+                                 np.empty(0, dtype=np.int64))
+        batches = _iter_kernel(network, state, pt, end, criteria, queue, 
+                               rng if p > 0 else None, c if p > 0 else 0.0, 
+                               facilitation, base, pc, nf, nfill, checkpoint, 
+                               checkpoint_interval, batch_size, pt_input, params, 
+                               stats, flood)
+        for batch in batches:
+            yield batch
+        if trapping:
+            state.apply_trapping(network, end)
+        return
+    
+    i = state.iterations
+    batch_start = i
+    fill_node = state.fill_node
+    fill_threshold = state.fill_threshold
+    profile = stats is not None
+    clock = time.perf_counter
+    while len(queue) > 0:
+        if profile:
+            t0 = clock()
+        if criteria.stop(i):
+            break
+        if profile:
+            t1 = clock()
+            stats.add('stop_criteria', t1 - t0)
+        
+        if p > 0:
+            rc = pow(rng.rand(), c)
+            selection = int(np.ceil(rc*len(queue)))
+            if selection == len(queue):
+                selection = selection - 1 # zero based index
+            fill = queue.pop(selection)
+        else:
+            fill = queue.pop()
+        threshold = pt[fill]
+        
+        occupy[fill] = True
+        front[fill] = False
+        criteria.update(fill, threshold)
+        if profile:
+            t2 = clock()
+            stats.add('select', t2 - t1)
+        neigh = indices[indptr[fill]:indptr[fill+1]]
+        if facilitation:
+            aff = neigh[~occupy[neigh]]
+            nfill[aff] += 1
+            pt[aff] = base[aff] + pc[aff]/_facilitation_multiplier(nfill[aff], nf[aff])
+            if profile:
+                t3 = clock()
+                stats.add('facilitation', t3 - t2)
+                t2 = t3
+            for n in aff:
+                if front[n]:
+                    queue.update(n)
+                else:
+                    front[n] = True
+                    queue.push(n)
+        else:
+            for n in neigh:
+                if not (occupy[n] or front[n]):
+                    front[n] = True
+                    queue.push(n)
+        if profile:
+            stats.add('update_neighbors', clock() - t2)
+        
+        # Gather results
+        if i == len(fill_node):
+            state.grow(i+1)
+            fill_node = state.fill_node
+            fill_threshold = state.fill_threshold
+        fill_node[i] = fill
+        fill_threshold[i] = threshold
+        state.order[fill] = i
+        state.threshold[fill] = threshold
+        
+        i = i+1
+        
+        if checkpoint and (i % checkpoint_interval == 0):
+            state.iterations = i
+            _save_checkpoint(checkpoint, state, pt_input, pc, end, params)
+        if i - batch_start == batch_size:
+            state.iterations = i
+            yield (batch_start, i)
+            batch_start = i
+    
+    state.iterations = i
+    if i > batch_start:
+        yield (batch_start, i)
+    
+    if trapping:
+        state.apply_trapping(network, end)
+
+def _iter_kernel(network, state, pt, end, criteria, queue, rng, c, facilitation, 
+                 base, pc, nf, nfill, checkpoint, checkpoint_interval, batch_size, 
+                 pt_input, params, stats=None, flood=False):
+    """
+    Generator that runs the compiled invasion kernel one batch at a time and 
+    yields the (start, stop) iterations of each batch, see _iter_invade
+    """
+    kernel = _compiled_kernel()
+    N = network.num_pores
+    front = state.front
+    if queue is None:
+        entries = np.flatnonzero(front & ~np.isnan(pt))
+        entries = entries[np.lexsort((entries, pt[entries]))]
+        capacity = len(entries) + N + (len(network.indices) if facilitation else 0)
+        heap_key = np.empty(capacity)
+        heap_node = np.empty(capacity, dtype=np.int64)
+        heap_key[:len(entries)] = pt[entries]
+        heap_node[:len(entries)] = entries
+        size = np.array([len(entries), len(entries)], dtype=np.int64)
+        tree = rank = rank_order = owner = current = np.empty(0, dtype=np.int64)
+        top_bit = 0
+    else:
+        heap_key = np.empty(0)
+        heap_node = np.empty(0, dtype=np.int64)
+        size = np.array([len(queue), 0], dtype=np.int64)
+        tree = np.array(queue.tree, dtype=np.int64)
+        (rank, rank_order, owner, current) = (queue.rank, queue.order, 
+                                              queue.owner, queue.current)
+        top_bit = queue.top_bit
+    counts = np.array([criteria.outlets, criteria.occupied], dtype=np.int64)
+    kernel_pc = pc if facilitation else np.empty(0)
+    last = np.array([criteria.threshold, 
+                     np.max(state.fill_threshold[:state.iterations], initial=-np.inf)])
+    flood_queue = np.empty(N if flood else 0, dtype=np.int64)
+    flood_pos = np.zeros(2, dtype=np.int64)
+    nf = np.asarray(nf, dtype=np.int64)
+    
+    i = state.iterations
+    while True:
+        stop = i + batch_size
+        if checkpoint:
+            stop = min(stop, (i // checkpoint_interval + 1)*checkpoint_interval)
+        state.grow(min(stop, N))
+        if rng is not None:
+            rng_state = rng.get_state()
+            draws = rng.rand(stop - i)
+        else:
+            draws = np.empty(0)
+        
+        t0 = time.perf_counter()
+        (j, stopped) = kernel(network.indptr, network.indices, end, state.occupy, 
+                              front, pt, state.order, state.threshold, 
+                              state.fill_node, state.fill_threshold, i, stop, 
+                              heap_key, heap_node, tree, rank, rank_order, owner, 
+                              current, top_bit, size, draws, float(c), facilitation, 
+                              base, kernel_pc, nf, nfill, counts, last, criteria.n_outlets, 
+                              criteria.max_iterations, float(criteria.max_occupied), 
+                              float(criteria.max_pressure), flood, flood_queue, 
+                              flood_pos)
+        if stats is not None:
+            stats.add('kernel', time.perf_counter() - t0)
+        if (rng is not None) and (j - i < len(draws)):
+            # Leave the generator after the draws that were used
+            rng.set_state(rng_state)
+            rng.rand(j - i)
+        
+        state.iterations = j
+        if checkpoint and (j > i) and (j % checkpoint_interval == 0):
+            _save_checkpoint(checkpoint, state, pt_input, pc, end, params)
+        if j > i:
+            yield (i, j)
+        i = j
+        if stopped or ((criteria.time_limit is not None) and 
+                       (time.time() - criteria.start_time > criteria.time_limit)):
+            break
 
 class InvasionPercolation(object):
     """
@@ -14,11 +1268,78 @@ class InvasionPercolation(object):
         self._g_angle = 180 # down
         
         self.pores = pd.DataFrame()
-        self.G = nx.Graph()
-        self.A = None
+        self.run_stats = None
+        self._G = None
+        self._A = None
+        self._indptr = None
+        self._indices = None
         self._nf = None
+    
+    @property
+    def G(self):
+        """
+        Pore network as a networkx graph, with node attribute 'pos' = (x,y,z).  
+        The graph is built from the pores and adjacency on first access and 
+        then cached, so runs that never use G do not pay for it.  Setting G 
+        replaces the adjacency used by the model.
+        """
+        if self._G is None:
+            G = nx.Graph()
+            if self._indptr is not None:
+                index = self.pores.index
+                pos = zip(self.pores['x'], self.pores['y'], self.pores['z'])
+                G.add_nodes_from([(node_id, {'pos': node}) for node_id, node in zip(index, pos)])
+                rows = np.repeat(np.arange(len(index)), self._nf)
+                mask = rows < self._indices
+                G.add_edges_from(zip(index[rows[mask]], index[self._indices[mask]]))
+            self._G = G
+        return self._G
+    
+    @G.setter
+    def G(self, G):
+        self._G = G
+        self._set_adjacency(G)
+    
+    @property
+    def network(self):
+        """
+        Read-only PoreNetwork view of the current pores and adjacency
+        """
+        return PoreNetwork(self.pores.index, self.pores['x'].values, 
+                           self.pores['y'].values, self.pores['z'].values, 
+                           self.pores['radius'].values, self.pores['grain'].values, 
+                           self._indptr, self._indices)
+    
+    @property
+    def A(self):
+        """
+        Adjacency as a pandas Series of neighbor pore id lists, indexed by 
+        pore id.  The Series is built from the CSR adjacency on first access 
+        and then cached, like G.
+        """
+        if self._A is None:
+            index = self.pores.index
+            neighbors = np.split(index.values[self._indices], self._indptr[1:-1])
+            self._A = pd.Series([list(n) for n in neighbors], index=index, dtype=object)
+        return self._A
+    
+    def _set_adjacency(self, G):
+        """
+        Set the CSR adjacency (pores renumbered to their row position in 
+        self.pores) and connectivity from the graph G
+        """
+        index = self.pores.index
+        edges = np.array(list(G.edges()))
+        if len(edges) == 0:
+            edges = np.zeros((0,2), dtype=int)
+        src = index.get_indexer(edges[:,0])
+        dst = index.get_indexer(edges[:,1])
+        
+        self._indptr, self._indices = _csr_from_edges(src, dst, len(index))
+        self._nf = np.diff(self._indptr) # connectivity
+        self._A = None
         
-    def setup_network(self, pore_file, throat_file):
+    def setup_network(self, pore_file, throat_file, chunksize=None):
         """
 		Setup a pore network model using a throat and pore file
         
@@ -32,27 +1353,71 @@ class InvasionPercolation(object):
             Name of the throat file. The throat file has 5 header lines followed 
             by three columns which store throat id, start pore id, and end pore id.
             See examples/data/throat.txt for an example.
+        chunksize : int
+            Number of rows to parse at a time, default = None (read each file 
+            at once).  Use for very large files to limit peak memory: pore 
+            chunks are copied into preallocated columns, and only the int32 
+            pore positions of each throat chunk are kept.
 		
 		"""
-        throats = pd.read_csv(throat_file, delim_whitespace=True, skiprows=5, header=None)
-        throats.columns = ['id', 'start', 'end']
-        throats.set_index('id', inplace=True)
-        pores = pd.read_csv(pore_file, delim_whitespace=True, skiprows=8, header=None)
-        pores.columns = ['id', 'x', 'y', 'z', 'radius', 'grain']
-        pores.set_index('id', inplace=True)
-        pores['pos'] = list(zip(pores.x, pores.y, pores.z))
-        G = nx.Graph()
-        node_bunch = [tuple([node_id, {'pos': node}]) for node_id, node in pores['pos'].iteritems()]
-        edge_bunch = [tuple([edge[0], edge[1]]) for edge_id, edge in throats.iterrows()]
-        G.add_nodes_from(node_bunch)
-        G.add_edges_from(edge_bunch)
-        del pores['pos']
+        pores = _read_pore_file(pore_file, chunksize)
+        (src, dst) = _read_throat_file(throat_file, pores.index, chunksize)
         
         self.pores = pores
-        self.G = G
-        self.A = pd.Series(dict([(n1,list(n2.keys())) for n1,n2 in G.adj.items()]))
-        self._nf = self.A.str.len() # connectivity
+        self._G = None
+        self._A = None
+        self._indptr, self._indices = _csr_from_edges(src, dst, len(pores))
+        self._nf = np.diff(self._indptr) # connectivity
         
+    def save_network(self, path):
+        """
+        Save the pore network (pore id, x, y, z, radius, grain, and adjacency) 
+        to a directory of binary .npy files which can be loaded using 
+        load_network
+        
+        Parameters
+        --------------
+        path : string
+            Name of the directory, created if it does not exist
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        
+        np.save(os.path.join(path, 'id.npy'), self.pores.index.values)
+        for col in _pore_columns[1:]:
+            np.save(os.path.join(path, col + '.npy'), self.pores[col].values)
+        np.save(os.path.join(path, 'indptr.npy'), self._indptr)
+        np.save(os.path.join(path, 'indices.npy'), self._indices)
+    
+    def load_network(self, path, mmap=True):
+        """
+        Load a pore network saved using save_network
+        
+        Parameters
+        --------------
+        path : string
+            Name of the directory
+        mmap : bool
+            If True (default), memory-map the files instead of reading them.  
+            The adjacency is mapped read-only and pore columns are mapped 
+            copy-on-write, so processes loading the same network share one 
+            copy in memory until a pore value is modified.
+        """
+        def load(name, mmap_mode):
+            return np.load(os.path.join(path, name + '.npy'), 
+                           mmap_mode=mmap_mode if mmap else None)
+        
+        index = pd.Index(load('id', 'r'), name='id')
+        pores = pd.DataFrame(dict([(col, load(col, 'c')) for col in _pore_columns[1:]]), 
+                             index=index, copy=False)
+        
+        self.pores = pores
+        self._G = None
+        self._A = None
+        self._indptr = load('indptr', 'r')
+        self._indices = load('indices', 'r')
+        self._nf = np.diff(self._indptr) # connectivity
+    
     def setup_grid(self, Nx, Ny, Nz, cell_size, radius=0, grain=0, seed=0):
         """
 		Setup a regular grid pore network model
@@ -75,31 +1440,13 @@ class InvasionPercolation(object):
         seed : int
             Seed used to define the normal distribution if a tuple is used to define radius
         """
-        if float(nx.__version__) >= 2:
-            G=nx.grid_graph(dim=[Nz,Ny,Nx]) # not sure why
-        else:
-            G=nx.grid_graph(dim=[Nx,Ny,Nz]) 
-        node_locations = list(G.nodes())
-        pos = dict(zip(G,node_locations))
-        nx.set_node_attributes(G, name='pos', values=pos)
-        # relabel nodes to index values (sorted by z, then y, then x)
-        # i + nx*(j+ny*k)
-        relabel_map = dict([(key,key[0]+Nx*(key[1]+(Ny*key[2]))) for key in pos.keys()])
-        G = nx.relabel_nodes(G, relabel_map)
-        
-        pos = nx.get_node_attributes(G, name='pos')
-        pores = pd.DataFrame(index=pos.keys())
-        pores.index.name = 'id'
-        X, Y, Z = zip(*pos.values())
-        pores['x'] = X
-        pores['y'] = Y
-        pores['z'] = Z
-        pores['x'] = pores['x']*cell_size
-        pores['y'] = pores['y']*cell_size
-        pores['z'] = pores['z']*cell_size
-        
-        pores.sort_values(['z', 'y', 'x'], inplace=True)
-             
+        N = Nx*Ny*Nz
+        ids = np.arange(N)
+        pores = pd.DataFrame(index=pd.Index(ids, name='id'))
+        pores['x'] = (ids % Nx)*cell_size
+        pores['y'] = ((ids // Nx) % Ny)*cell_size
+        pores['z'] = (ids // (Nx*Ny))*cell_size
+        
         # Set grain type
         if isinstance(grain, np.ndarray):
             pores['grain'] = grain
@@ -118,18 +1465,20 @@ class InvasionPercolation(object):
             r_std = radius[1]
             r_min = radius[2]
             np.random.seed(seed)
-            R = np.random.normal(r_mean, r_std, len(X))
+            R = np.random.normal(r_mean, r_std, N)
             R[R<r_min] = r_min
             pores['radius'] = R
         else:
             pores['radius'] = np.nan
         
         self.pores = pores
-        self.G = G
-        self.A = pd.Series(dict([(n1,list(n2.keys())) for n1,n2 in G.adj.items()]))
-        self._nf = self.A.str.len() # connectivity
+        self._G = None
+        self._A = None
+        self._indptr, self._indices = _grid_adjacency(Nx, Ny, Nz)
+        self._nf = np.diff(self._indptr) # connectivity
     
-    def initialize_pores(self, contact_angles, invading_density, defending_density, tension):
+    def initialize_pores(self, contact_angles, invading_density, defending_density, tension, 
+                         dtype=np.float64):
         """
         Initialize pores
         
@@ -143,43 +1492,62 @@ class InvasionPercolation(object):
             Defending fluid density (kg/m3)
         tension : float
             Surface tension (N/m)
+        dtype : numpy dtype
+            Data type of pc, pg, and pt, default = np.float64.  np.float32 
+            halves the memory used by the pressures, with less precision.
+        
+        The contact angle of each pore is looked up from its grain type in one 
+        pass (pores with a grain type outside of contact_angles are NaN).  
+        start, end, occupy, and neighbor are stored as uint8 (0 or 1).
         """
-        self.pores['angle'] = np.NaN
-        for i, n in enumerate(contact_angles):
-            self.pores.loc[self.pores['grain'] == i, 'angle'] = n
-    
-        self.pores['pc']  = (-2.0*tension*np.cos(self.pores.angle*np.pi/180))/self.pores.radius # Capillary pressure, Pa
-        self.pores['pg'] = (defending_density-invading_density)*self._g*np.cos(self._g_angle*np.pi/180)*self.pores.z # Bouyancy pressure, Pa
-        self.pores['pt']= self.pores.pc + self.pores.pg                  
+        angles = np.append(np.asarray(contact_angles, dtype=float), np.nan)
+        grain = self.pores['grain'].values
+        valid = (grain >= 0) & (grain < len(contact_angles))
+        grain = np.where(valid, grain, len(contact_angles)).astype(np.intp)
         
-        self.pores['start'] = self.pores.z <= min(self.pores.z)
-        self.pores['end'] = self.pores.z >= max(self.pores.z)
-        self.pores['occupy'] = self.pores['start']
-        self.pores['neighbor'] = False
+        z = self.pores['z'].values
+        radius = self.pores['radius'].values
+        self.pores['angle'] = np.take(angles, grain)
+        pc = (-2.0*tension*np.take(np.cos(angles*np.pi/180), grain))/radius # Capillary pressure, Pa
+        pg = (defending_density-invading_density)*self._g*np.cos(self._g_angle*np.pi/180)*z # Bouyancy pressure, Pa
+        self.pores['pc'] = pc.astype(dtype)
+        self.pores['pg'] = pg.astype(dtype)
+        self.pores['pt'] = (pc + pg).astype(dtype)
         
-        self.pores.start = self.pores.start.astype(int)
-        self.pores.end = self.pores.end.astype(int)
-        self.pores.occupy = self.pores.occupy.astype(int)
-        self.pores.neighbor = self.pores.neighbor.astype(int)
+        start = z <= z.min()
+        self.pores['start'] = start.astype(np.uint8)
+        self.pores['end'] = (z >= z.max()).astype(np.uint8)
+        self.pores['occupy'] = start.astype(np.uint8)
+        self.pores['neighbor'] = np.zeros(len(z), dtype=np.uint8)
         
         self.tension = tension
     
-    def _update_facilitation(self):
+    def _update_facilitation(self, previous_filled_node=None):
         """
-        BETA Update Pc and Pt for neighbor nodes by adjusting the radius based on 
-        connectivity and filled pores
+        Update Pt for neighbor nodes by adjusting the radius based on 
+        connectivity and the number of filled neighbors.
+        
+        If the previously filled node is handed to _update_facilitation, then 
+        only its unfilled neighbors are updated.  Otherwise all neighbor nodes 
+        are updated.
         """
-        neighbor_pores = self.pores.index[self.pores.neighbor == 1]
-        neighbor_A = self.A[neighbor_pores]
+        occupy = self.pores['occupy'].values > 0
+        if previous_filled_node is None:
+            pore_idx = np.flatnonzero(self.pores['neighbor'].values > 0)
+        else:
+            pos = self.pores.index.get_loc(previous_filled_node)
+            neigh = self._indices[self._indptr[pos]:self._indptr[pos+1]]
+            pore_idx = neigh[~occupy[neigh]]
+        nf = self._nf[pore_idx]
         
-        n = [len(set(x) & set(neighbor_pores)) for x in neighbor_A]
-        n = pd.Series(index=neighbor_pores, data=n)
-        nf = self._nf[neighbor_pores]
-        radius_multiplier = pd.Series(index=self.pores.index, data=1)
-        radius_multiplier[neighbor_pores] = 2-((n/nf-1/nf)/(1-1/nf))
+        neigh = _csr_gather(self._indptr, self._indices, pore_idx)
+        rows = np.repeat(np.arange(len(pore_idx)), nf)
+        n = np.bincount(rows, weights=occupy[neigh], minlength=len(pore_idx))
+        radius_multiplier = _facilitation_multiplier(n, nf)
         
-        self.pores.pc = (-2.0*self.tension*np.cos(self.pores.angle*np.pi/180))/(self.pores.radius*radius_multiplier)
-        self.pores.pt = self.pores.pc + self.pores.pg
+        pc = self.pores['pc'].values
+        col = self.pores.columns.get_loc('pt')
+        self.pores.iloc[pore_idx, col] = self._pt_base[pore_idx] + pc[pore_idx]/radius_multiplier
 
     def _set_stochastic_parameters(self, p=0):
         """ 
@@ -203,30 +1571,34 @@ class InvasionPercolation(object):
         only a small section is updated. If the previously filled node is NOT 
         handed to update_neighbor, then the entire neighbor list is updated.
         """
+        occupy = self.pores['occupy'].values
         if previous_filled_node:
-            self.pores.loc[previous_filled_node,'neighbor'] = 0
-            neigh = self.A[previous_filled_node]
-            #pore_idx = self.pores.index[self.pores.occupy > 0]
-            #neighbor_idx = set(neigh) - set(pore_idx)
-            neighbor_idx = (self.pores.loc[neigh,'occupy'] == 0)
-            neighbor_idx = neighbor_idx.index[neighbor_idx]
+            col = self.pores.columns.get_loc('neighbor')
+            pore_idx = self.pores.index.get_loc(previous_filled_node)
+            self.pores.iloc[pore_idx, col] = 0
+            neigh = self._indices[self._indptr[pore_idx]:self._indptr[pore_idx+1]]
+            self.pores.iloc[neigh[occupy[neigh] == 0], col] = 1
         else:
-            self.pores.neighbor = 0
-            pore_idx = self.pores.index[self.pores.occupy > 0]
-            neigh = self.A[pore_idx]
-            neigh = list(itertools.chain.from_iterable(neigh.values))
-            neighbor_idx = set(neigh) - set(pore_idx)
-            #neighbor_idx = (self.pores.loc[neigh,'occupy'] == 0)
-            #neighbor_idx = neighbor_idx.index[neighbor_idx]
-        self.pores.loc[neighbor_idx,'neighbor'] = 1
+            pore_idx = np.flatnonzero(occupy > 0)
+            neigh = _csr_gather(self._indptr, self._indices, pore_idx)
+            neighbor = np.zeros(len(occupy), dtype=np.uint8)
+            neighbor[neigh[occupy[neigh] == 0]] = 1
+            self.pores['neighbor'] = neighbor
     
     def _select_node(self):
         """
-        Select the next node to fill
+        Select the next node to fill.  Front pores with a NaN total pressure 
+        are skipped, and filled_node is None if no front pore can be filled.  
+        Ties in total pressure are broken by pore position, for p = 0 and 
+        p > 0.
         """
-        potential_fill = self.pores.pt[self.pores.neighbor == 1]
+        potential_fill = self.pores.pt[self.pores.neighbor == 1].dropna()
+        if len(potential_fill) == 0:
+            return (None, np.nan)
         if not np.isinf(self._c):
-            potential_fill.sort_values(inplace=True) # smallest on top
+            # Stable sort, smallest on top, so tied pressures stay in pore 
+            # position order, as in the heap and numba engines
+            potential_fill.sort_values(inplace=True, kind='mergesort')
             rc = pow(np.random.rand(),self._c)
             selection = int(np.ceil(rc*len(potential_fill)))
             if selection == len(potential_fill):
@@ -241,24 +1613,36 @@ class InvasionPercolation(object):
         
         return (filled_node, threshold)
 
-    def _stop_criteria(self, i, max_iterations):
+    def _check_run_parameters(self, p, engine, trapping, facilitation, checkpoint, 
+                              batch, engines=('pandas', 'heap', 'numba')):
         """
-        Check stop criteria.  Stop if an occupied node reached the 'end' or 
-        if max iterations has been exceeded.
+        Check the parameters of run and iter_run, print a message and return 
+        False if they are not valid
         """
-        stop = False
-        
-        reached_end = (self.pores.end + self.pores.occupy).max()
-        if reached_end > 1:
-            stop = True
-        
-        if max_iterations > 0:
-            if i > max_iterations:
-                stop = True
+        if (p > 1) or (p < 0):
+            print('p must be in [0,1]')
+            return False
+        if engine not in engines:
+            names = ', '.join(engines[:-1]) + (',' if len(engines) > 2 else '')
+            print('engine must be ' + names + ' or ' + engines[-1])
+            return False
+        if trapping and (p > 0):
+            print('trapping requires p = 0')
+            return False
+        if checkpoint and (engine == 'pandas'):
+            print('checkpoints require the heap or numba engine')
+            return False
+        if batch and ((p > 0) or (engine == 'pandas') or trapping or facilitation or checkpoint):
+            print('batch requires p = 0 and the heap or numba engine, without ' + 
+                  'trapping, facilitation, or checkpoints')
+            return False
         
-        return stop
-                
-    def run(self, max_iterations=-1, p=0, seed=0):
+        return True
+    
+    def run(self, max_iterations=-1, p=0, seed=0, engine='pandas', n_outlets=1, 
+            max_saturation=None, max_pressure=None, time_limit=None, trapping=False, 
+            facilitation=False, checkpoint=None, checkpoint_interval=100000, 
+            callback=None, batch_size=10000, profile=False, progress=None, batch=False):
         """
 		Run invasion percolation model
 		
@@ -270,35 +1654,466 @@ class InvasionPercolation(object):
 			Stochastic process parameter, between 0 and 1
 		seed : int
 			Random seed used in the stochastic process
+		engine : string
+			Invasion engine, 'pandas' (default), 'heap', or 'numba'.  The 'heap' 
+			engine keeps the invasion front in a priority queue (p = 0) or an 
+			order-statistic tree (p > 0) and is much faster on large networks.  
+			The 'numba' engine runs the same algorithm in a compiled kernel and 
+			gives the same results.  If numba is not installed, the 'heap' 
+			engine is used.  In all engines, ties in total pressure are broken 
+			by pore position, so a given seed gives the same fill sequence.  With the 'numba' engine, time_limit is checked 
+			after each batch of batch_size fills.
+		n_outlets : int
+			Stop when this many end pores are occupied, default = 1
+		max_saturation : float
+			Stop when this fraction of all pores is occupied, default = None
+		max_pressure : float
+			Stop after a pore is filled at a threshold above this pressure (Pa), 
+			default = None
+		time_limit : float
+			Stop after this many seconds of wall-clock time, default = None
+		
+		trapping : bool
+			If True, defending fluid cut off from the end pores is trapped 
+			(incompressible) and pores of trapped defending fluid are not 
+			filled, default = False.  Trapped pores are stored in 
+			pores['trapped'].  Trapping requires p = 0, and stop criteria are 
+			evaluated before trapped fills are removed.
+		facilitation : bool
+			If True, the radius of each pore along the interface is multiplied by 
+			2 - (n-1)/(nf-1), where n is the number of filled neighbors and nf 
+			is the connectivity, default = False.  pores['pt'] is updated for 
+			pores along the interface.
+		checkpoint : string
+			Name of a checkpoint file written every checkpoint_interval 
+			iterations, default = None.  Use resume to continue a run from the 
+			checkpoint.  Checkpoints require the heap or numba engine.
+		checkpoint_interval : int
+			Number of iterations between checkpoints
+		callback : function
+			Function called as callback(iteration, node, threshold) with arrays 
+			of the iteration, filled pore, and threshold of each batch of 
+			batch_size fills, as the run progresses, default = None.  Fills 
+			later removed by trapping are included.
+		batch_size : int
+			Number of fills per callback
+		profile : bool
+			If True, record the cumulative time and number of calls of each 
+			phase of the invasion loop in run_stats, default = False
+		progress : function
+			Function called as progress(run_stats) after each batch of 
+			batch_size fills, default = None
+		batch : bool
+			If True, front pores at or below the running maximum threshold are 
+			filled in bulk, in the order they are reached, without a priority 
+			queue operation per fill (priority-flood), default = False.  The 
+			same pores are filled below each running maximum and the 
+			breakthrough pressure is unchanged, but fills are not in order of 
+			total pressure within each bulk fill, so the occupancy when a stop 
+			criterion is met can differ.  Use batch = False for the exact fill 
+			order.  batch requires p = 0 and the heap or numba engine, without 
+			trapping, facilitation, or checkpoints.
+		
+		When profile is True or progress is given, run_stats is a RunStats 
+		object with the number of fills, fills per second, and front size 
+		after each batch.  Otherwise run_stats is None and no statistics 
+		are recorded.
+		
+		Fills are stored in preallocated arrays that grow geometrically, and 
+		stop criteria are updated as each pore is filled, so checking them 
+		does not depend on the number of pores.
 		"""
-        if (p > 1) or (p < 0):
-            print('p must be in [0,1]')
+        if not self._check_run_parameters(p, engine, trapping, facilitation, 
+                                          checkpoint, batch):
             return
         
         np.random.seed(seed)
         
-        facilitation=False # BETA, not fully tested (and slow).
+        if engine in ['heap', 'numba']:
+            batches = self.iter_run(max_iterations, p, seed, n_outlets, 
+                                    max_saturation, max_pressure, time_limit, 
+                                    trapping, facilitation, checkpoint, 
+                                    checkpoint_interval, batch_size, engine, 
+                                    profile, progress, batch)
+            for fills in batches:
+                if callback is not None:
+                    callback(*fills)
+            return
         
-        thresh = []
-        node = []
+        network = self.network
+        state = SimulationState(network.num_pores)
+        stats = RunStats() if (profile or progress is not None) else None
+        self.run_stats = stats
         
+        self.pores['occupy'] = (self.pores['occupy'].values > 0).astype(np.uint8)
         self._set_stochastic_parameters(p)   
         self.update_neighbors()
-        if facilitation: self._update_facilitation()
+        if facilitation: 
+            self._pt_base = self.pores['pt'].values - self.pores['pc'].values
+            self._update_facilitation()
+        
+        start = self.pores['occupy'].values > 0
+        state.reset(start)
+        criteria = _StopCriteria(self.pores['end'].values > 0, start, max_iterations, 
+                                 n_outlets, max_saturation, max_pressure, time_limit)
+        
+        def end_batch(batch_start, i):
+            if callback is not None:
+                callback(np.arange(batch_start, i), network.index[state.fill_node[batch_start:i]], 
+                         state.fill_threshold[batch_start:i].copy())
+            if stats is not None:
+                stats.sample(i, int(np.count_nonzero(self.pores['neighbor'].values)))
+                if progress is not None:
+                    progress(stats)
         
         i = 0
+        batch_start = 0
+        clock = time.perf_counter
         while True:
-            if self._stop_criteria(i, max_iterations):
+            if profile:
+                t0 = clock()
+            if criteria.stop(i):
                 break
+            if profile:
+                t1 = clock()
+                stats.add('stop_criteria', t1 - t0)
             
             (filled_node, threshold) = self._select_node()
+            if filled_node is None:
+                break
+            fill = self.pores.index.get_loc(filled_node)
+            criteria.update(fill, threshold)
+            if profile:
+                t2 = clock()
+                stats.add('select', t2 - t1)
             self.update_neighbors(filled_node)
-            if facilitation: self._update_facilitation()
+            if profile:
+                t3 = clock()
+                stats.add('update_neighbors', t3 - t2)
+            if facilitation: 
+                self._update_facilitation(filled_node)
+                if profile:
+                    stats.add('facilitation', clock() - t3)
             
             # Gather results
-            thresh.append(threshold)
-            node.append(filled_node)
+            state.grow(i+1)
+            state.fill_node[i] = fill
+            state.fill_threshold[i] = threshold
                             
             i = i+1
+            
+            if i - batch_start == batch_size:
+                end_batch(batch_start, i)
+                batch_start = i
+        
+        if i > batch_start:
+            end_batch(batch_start, i)
+        
+        state.iterations = i
+        (filled, thresh) = state.fill_order()
+        self.results = pd.DataFrame({'threshold': thresh,
+                                     'node': network.index[filled]})
+        
+        if trapping:
+            state.occupy[filled] = True
+            state.order[filled] = np.arange(len(filled))
+            state.threshold[filled] = thresh
+            state.apply_trapping(network, self.pores['end'].values > 0)
+            self._set_state(network, state, trapping)
+    
+    def iter_run(self, max_iterations=-1, p=0, seed=0, n_outlets=1, max_saturation=None, 
+                 max_pressure=None, time_limit=None, trapping=False, facilitation=False, 
+                 checkpoint=None, checkpoint_interval=100000, batch_size=10000, 
+                 engine='heap', profile=False, progress=None, batch=False):
+        """
+		Run invasion percolation model with the heap or numba engine, yielding 
+		results in batches as the run progresses
+		
+		Parameters are the same as run.  The pores DataFrame and results are 
+		set when the generator is exhausted.
+		
+		Yields
+		--------------
+		iteration : numpy array of int
+			Iteration of each fill in the batch
+		node : numpy array
+			Filled pore of each fill in the batch
+		threshold : numpy array of float
+			Threshold of each fill in the batch
+		
+		Fills later removed by trapping are included.  If the parameters are 
+		not valid, a message is printed and nothing is yielded.
+		"""
+        if not self._check_run_parameters(p, engine, trapping, facilitation, 
+                                          checkpoint, batch, ('heap', 'numba')):
+            return
+        if (engine == 'numba') and (numba is None):
+            print('numba is not installed, using the heap engine')
         
-        self.results = pd.DataFrame({'threshold': thresh,'node': node})
\ No newline at end of file
+        network = self.network
+        state = SimulationState(network.num_pores)
+        state.reset(self.pores['occupy'].values > 0)
+        stats = RunStats() if (profile or progress is not None) else None
+        self.run_stats = stats
+        batches = _iter_invade(network, self.pores['pt'].values, 
+                               self.pores['end'].values > 0, state, max_iterations, 
+                               p, seed, trapping, facilitation, 
+                               self.pores['pc'].values if facilitation else None, 
+                               checkpoint, checkpoint_interval, batch_size, 
+                               compiled=(engine == 'numba'), 
+                               stats=stats if profile else None, flood=batch, 
+                               n_outlets=n_outlets, max_saturation=max_saturation, 
+                               max_pressure=max_pressure, time_limit=time_limit)
+        for (start, stop) in batches:
+            if stats is not None:
+                stats.sample(stop, int(np.count_nonzero(state.front)))
+                if progress is not None:
+                    progress(stats)
+            yield (np.arange(start, stop), network.index[state.fill_node[start:stop]], 
+                   state.fill_threshold[start:stop].copy())
+        if facilitation:
+            self.pores['pt'] = state.pt
+        self._set_state(network, state, trapping)
+    
+    def resume(self, checkpoint):
+        """
+        Continue a run from a checkpoint file written by run.  The pore 
+        network must be the same as the network used to write the checkpoint.  
+        The run continues with the same parameters and random state, and 
+        gives the same results as a run that was not interrupted.  Checkpoints 
+        continue to be written to the same file.
+        
+        Parameters
+        --------------
+        checkpoint : string
+            Name of the checkpoint file
+        """
+        network = self.network
+        (state, kwds) = _load_checkpoint(checkpoint, network)
+        pt = kwds.pop('pt')
+        end = kwds.pop('end')
+        invade(network, pt, end, state, checkpoint=checkpoint, **kwds)
+        
+        self.pores['pt'] = state.pt if kwds['facilitation'] else pt
+        self.pores['end'] = end.astype(np.uint8)
+        self._set_state(network, state, kwds['trapping'])
+    
+    def _set_state(self, network, state, trapping=False):
+        """
+        Store a SimulationState in pores and results
+        """
+        (node, thresh) = state.fill_order()
+        self.pores['occupy'] = state.occupy.astype(np.uint8)
+        self.pores['neighbor'] = state.front.astype(np.uint8)
+        if trapping:
+            self.pores['trapped'] = state.trapped.astype(np.uint8)
+        self.results = pd.DataFrame({'threshold': thresh,'node': network.index[node]})
+    
+    def run_ensemble(self, seeds, p, max_iterations=-1, engine='pandas', n_workers=None):
+        """
+        Run one stochastic realization per seed over a pool of processes.
+        
+        The network and initialized pores are written once to a memory-mapped 
+        network directory (in shared memory when /dev/shm is available), 
+        which each worker maps instead of receiving a pickled copy of the model.
+        Pores must be initialized before calling run_ensemble.  Each 
+        realization starts from pores['start'], so occupancy left by a 
+        previous run is ignored.  The state of this model is not changed.
+        
+        Parameters
+        --------------
+        seeds : list of int
+            Random seeds, one realization per seed
+        p : float
+            Stochastic process parameter, between 0 and 1
+        max_iterations : int
+            Maximum number of iteration, -1 = run to completion
+        engine : string
+            Invasion engine, see run
+        n_workers : int
+            Number of worker processes, default = number of CPUs
+        
+        Returns
+        --------
+        occupancy : pandas Series
+            Fraction of realizations in which each pore is occupied, indexed 
+            by pore id
+        realizations : pandas DataFrame
+            One row per seed with the number of iterations, breakthrough 
+            threshold (maximum filled pressure), and whether the invading 
+            fluid reached an end pore
+        """
+        if (p > 1) or (p < 0):
+            print('p must be in [0,1]')
+            return
+        
+        tasks = [(seed, p, max_iterations, engine) for seed in seeds]
+        arrays = {'pt': self.pores['pt'].values, 'end': self.pores['end'].values, 
+                  'occupy': self.pores['start'].values}
+        outputs = self._map_shared(_run_realization, tasks, arrays, n_workers)
+        
+        index = self.pores.index
+        end = self.pores['end'].values > 0
+        initial = self.pores['start'].values > 0
+        count = np.zeros(len(index))
+        realizations = []
+        for seed, (thresh, node) in zip(seeds, outputs):
+            filled = initial.copy()
+            filled[node] = True
+            count += filled
+            realizations.append({'seed': seed, 
+                                 'iterations': len(node), 
+                                 'threshold': np.max(thresh) if len(thresh) > 0 else np.nan, 
+                                 'breakthrough': bool(np.any(filled & end))})
+        
+        occupancy = pd.Series(count/len(seeds), index=index)
+        realizations = pd.DataFrame(realizations, columns=['seed', 'iterations', 
+                                                           'threshold', 'breakthrough'])
+        
+        return occupancy, realizations
+    
+    def sweep(self, contact_angles, invading_density, defending_density, tension, 
+              max_iterations=-1, p=0, seed=0, engine='pandas', n_workers=None):
+        """
+        Run the model for every combination of contact angles, fluid densities 
+        and surface tension over a pool of processes.
+        
+        The network geometry is written once to a memory-mapped network 
+        directory and shared by the workers.  Total pressure for each 
+        combination is computed by the worker from per-grain capillary 
+        coefficients, so only a few numbers are sent per task.  Each run 
+        starts from pores['start'] and ends at pores['end'] if 
+        initialize_pores has been called (so occupancy left by a previous run 
+        is ignored), otherwise the defaults from initialize_pores are used.  
+        The state of this model is not changed.
+        
+        Parameters
+        --------------
+        contact_angles : list of lists of floats
+            Contact angles (degrees) to sweep, each entry has one value per grain type
+        invading_density : list of floats
+            Invading fluid densities to sweep (kg/m3)
+        defending_density : list of floats
+            Defending fluid densities to sweep (kg/m3)
+        tension : list of floats
+            Surface tensions to sweep (N/m)
+        max_iterations : int
+            Maximum number of iteration, -1 = run to completion
+        p : float
+            Stochastic process parameter, between 0 and 1
+        seed : int
+            Random seed used in the stochastic process
+        engine : string
+            Invasion engine, see run
+        n_workers : int
+            Number of worker processes, default = number of CPUs
+        
+        Returns
+        --------
+        pandas DataFrame
+            One row per combination with the parameters, number of iterations, 
+            breakthrough threshold (maximum filled pressure), whether the 
+            invading fluid reached an end pore, and the fraction of pores 
+            occupied at the end of the run
+        """
+        if (p > 1) or (p < 0):
+            print('p must be in [0,1]')
+            return
+        
+        combos = list(itertools.product(range(len(contact_angles)), invading_density, 
+                                        defending_density, tension))
+        angle_idx, rho_i, rho_d, gamma = [np.array(x) for x in zip(*combos)]
+        angles = np.array(contact_angles, dtype=float)[angle_idx]
+        
+        # Capillary coefficient per combination and grain type, and buoyancy 
+        # coefficient per combination, so that pt = a[grain]/radius + b*z
+        a = (-2.0*gamma[:,np.newaxis]*np.cos(angles*np.pi/180))
+        b = (rho_d-rho_i)*self._g*np.cos(self._g_angle*np.pi/180)
+        
+        if 'start' in self.pores.columns:
+            end = self.pores['end'].values
+            occupy = self.pores['start'].values
+        else:
+            z = self.pores['z'].values
+            end = (z >= z.max()).astype(np.uint8)
+            occupy = (z <= z.min()).astype(np.uint8)
+        
+        tasks = [(a[k], b[k], p, seed, max_iterations, engine) for k in range(len(combos))]
+        arrays = {'end': end, 'occupy': occupy}
+        outputs = self._map_shared(_run_sweep_point, tasks, arrays, n_workers)
+        
+        results = pd.DataFrame(outputs, columns=['iterations', 'threshold', 
+                                                 'breakthrough', 'saturation'])
+        results.insert(0, 'contact_angles', [tuple(contact_angles[k]) for k in angle_idx])
+        results.insert(1, 'invading_density', rho_i)
+        results.insert(2, 'defending_density', rho_d)
+        results.insert(3, 'tension', gamma)
+        
+        return results
+    
+    def _map_shared(self, func, tasks, arrays, n_workers=None):
+        """
+        Save the network and additional pore arrays to a temporary network 
+        directory (in shared memory when /dev/shm is available) and map func 
+        over (path,) + task for each task using a process pool
+        """
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        path = tempfile.mkdtemp(prefix='pyperc_', dir=shm)
+        try:
+            self.save_network(path)
+            for name, values in arrays.items():
+                np.save(os.path.join(path, name + '.npy'), values)
+            
+            args = [(path,) + tuple(task) for task in tasks]
+            with ProcessPoolExecutor(n_workers) as executor:
+                outputs = list(executor.map(func, args))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+        
+        return outputs
+
+def _load_shared(path, columns):
+    """
+    Load a network and additional pore columns saved by _map_shared
+    """
+    ip = InvasionPercolation()
+    ip.load_network(path)
+    for col in columns:
+        ip.pores[col] = np.load(os.path.join(path, col + '.npy'), mmap_mode='c')
+    
+    return ip
+
+def _run_realization(args):
+    """
+    Run one realization on a network saved by run_ensemble and return the 
+    filled thresholds and pore positions
+    """
+    (path, seed, p, max_iterations, engine) = args
+    ip = _load_shared(path, ['pt', 'end', 'occupy'])
+    ip.run(max_iterations, p, seed, engine)
+    
+    return (ip.results['threshold'].values, 
+            ip.pores.index.get_indexer(ip.results['node'].values).astype(np.int32))
+
+def _run_sweep_point(args):
+    """
+    Run one parameter combination on a network saved by sweep and return 
+    a summary of the run
+    """
+    (path, a, b, p, seed, max_iterations, engine) = args
+    ip = _load_shared(path, ['end', 'occupy'])
+    # Pores with a grain type outside of contact_angles are NaN, as in 
+    # initialize_pores
+    grain = ip.pores['grain'].values
+    valid = (grain >= 0) & (grain < len(a))
+    grain = np.where(valid, grain, len(a)).astype(np.intp)
+    a = np.append(a, np.nan)
+    ip.pores['pt'] = np.take(a, grain)/ip.pores['radius'].values + b*ip.pores['z'].values
+    ip.run(max_iterations, p, seed, engine)
+    
+    occupy = ip.pores['occupy'].values > 0
+    end = ip.pores['end'].values > 0
+    threshold = ip.results['threshold'].max() if len(ip.results) > 0 else np.nan
+    
+    return (len(ip.results), threshold, bool(np.any(occupy & end)), occupy.mean())
+
@@ -0,0 +1,123 @@
+from nose.tools import *
+import numpy as np
+import pandas as pd
+import pyperc
+
+def _run(p=0, trapping=False):
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(123)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+    ip.initialize_pores([124], 1400, 1000, 0.03)
+    ip.run(p=p, engine='heap', trapping=trapping)
+    
+    return ip
+
+def test_drainage_curve():
+    ip = _run()
+    curve = pyperc.analysis.drainage_curve(ip)
+    N = len(ip.pores)
+    initial = ip.pores.start.sum()
+    
+    assert_equal(list(curve.columns), ['threshold', 'pressure', 'saturation', 
+                                       'volume_saturation'])
+    assert_equal(len(curve), len(ip.results))
+    assert_true(np.all(np.diff(curve.pressure) >= 0))
+    assert_equal(curve.pressure.iloc[-1], ip.results.threshold.max())
+    assert_almost_equal(curve.saturation.iloc[0], (initial + 1)/N)
+    assert_almost_equal(curve.saturation.iloc[-1], ip.pores.occupy.sum()/N)
+    
+    volume = ip.pores.radius**3
+    assert_almost_equal(curve.volume_saturation.iloc[-1], 
+                        volume[ip.pores.occupy == 1].sum()/volume.sum())
+    
+    # Saturation at each pressure level matches the pores below that level
+    levels = pyperc.analysis.drainage_curve(ip, levels=True)
+    assert_equal(len(levels), len(np.unique(curve.pressure)))
+    for pressure, saturation in zip(levels.pressure, levels.saturation):
+        below = (curve.pressure <= pressure).sum()
+        assert_almost_equal(saturation, (initial + below)/N)
+
+def test_breakthrough_pressure():
+    ip = _run()
+    assert_equal(pyperc.analysis.breakthrough_pressure(ip), ip.results.threshold.max())
+    
+    ip.pores.end = 0
+    assert_true(np.isnan(pyperc.analysis.breakthrough_pressure(ip)))
+
+def test_cluster_growth():
+    ip = _run()
+    growth = pyperc.analysis.cluster_growth(ip)
+    filled = ip.pores.loc[ip.results.node]
+    
+    assert_equal(len(growth), len(ip.results))
+    assert_equal(growth.mass.iloc[-1], len(ip.results))
+    assert_equal(growth.z_min.iloc[-1], filled.z.min())
+    assert_equal(growth.z_max.iloc[-1], filled.z.max())
+    assert_equal(growth.vertical_extent.iloc[-1], filled.z.max() - filled.z.min())
+    assert_true(np.all(np.diff(growth.vertical_extent) >= 0))
+    rg = np.sqrt(((filled[['x', 'y', 'z']] - filled[['x', 'y', 'z']].mean())**2).sum(axis=1).mean())
+    assert_almost_equal(growth.radius_of_gyration.iloc[-1], rg)
+    
+    growth = pyperc.analysis.cluster_growth(ip, include_initial=True)
+    assert_equal(growth.mass.iloc[-1], ip.pores.occupy.sum())
+
+def test_fractal_dimension():
+    # Fully invaded planar grid
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(32,1,32,0.01,np.ones(32*32)*1e-4)
+    ip.pores['occupy'] = 1
+    ip.results = pd.DataFrame({'node': ip.pores.index, 'threshold': 0.0})
+    
+    (count, dimension) = pyperc.analysis.box_counting(ip, sizes=[0.01, 0.02, 0.04, 0.08])
+    assert_equal(list(count['count']), [1024, 256, 64, 16])
+    assert_almost_equal(dimension, 2.0)
+    
+    (mass, dimension) = pyperc.analysis.mass_radius(ip)
+    assert_equal(mass['mass'].iloc[-1], 1024)
+    assert_true(abs(dimension - 2.0) < 0.3)
+    
+    # Clusters with no fills or one fill have no dimension
+    for n in [0, 1]:
+        ip.results = pd.DataFrame({'node': ip.pores.index[:n], 'threshold': 0.0})
+        (mass, dimension) = pyperc.analysis.mass_radius(ip)
+        assert_equal(len(mass), 0)
+        assert_true(np.isnan(dimension))
+        (count, dimension) = pyperc.analysis.box_counting(ip)
+        assert_equal(len(count), n)
+        assert_true(np.isnan(dimension))
+
+def test_finger_width():
+    # Two vertical fingers, 1 and 2 pores wide
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(10,1,5,0.01,np.ones(50)*1e-4)
+    ip.pores['occupy'] = 0
+    ip.pores.loc[(ip.pores.x == 0.02) | (ip.pores.x >= 0.06) & (ip.pores.x <= 0.07), 'occupy'] = 1
+    width = pyperc.analysis.finger_width(ip)
+    
+    assert_equal(len(width), 5)
+    assert_equal(list(width.pores), [3]*5)
+    assert_equal(list(width.fingers), [2]*5)
+    assert_equal(list(width.mean_width), [1.5]*5)
+
+def test_num_branches():
+    ip = _run()
+    tree = pyperc.analysis.invasion_tree(ip)
+    
+    assert_equal(len(tree), len(ip.results))
+    order = dict(zip(ip.results.node, range(len(ip.results))))
+    for node, parent in tree.items():
+        assert_true(parent in ip.A[node])
+        assert_true(order.get(parent, -1) < order[node])
+    
+    # A single straight finger has one branch
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(3,1,10,0.01,np.ones(30)*1e-4)
+    ip.pores['occupy'] = 0
+    column = ip.pores.index[(ip.pores.x == 0.01)]
+    ip.pores.loc[column, 'occupy'] = 1
+    ip.results = pd.DataFrame({'node': column[1:], 'threshold': 0.0})
+    assert_equal(pyperc.analysis.num_branches(ip), 1)
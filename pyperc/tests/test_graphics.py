@@ -1,6 +1,8 @@
 from nose.tools import *
 from os.path import abspath, dirname, join, isfile
+from math import isnan
 import os
+import numpy as np
 import pyperc
 
 testdir = dirname(abspath(str(__file__)))
@@ -25,6 +27,92 @@ def test_plot_3D_network():
     
     assert_true(isfile(filename))
     
+def test_plot_3D_network_model():
+    filename = abspath(join(testdir, 'plot_3D_network_model.html'))
+    if isfile(filename):
+        os.remove(filename)
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(4, 3, 2, 0.0005, 0.0002, 0)
+    
+    # Edge coordinates match the networkx graph, with NaN separators
+    (index, pos, indptr, indices) = pyperc.graphics._network_arrays(ip)
+    (index_G, pos_G, indptr_G, indices_G) = pyperc.graphics._network_arrays(ip.G)
+    assert_true((index == index_G).all())
+    assert_true((pos == pos_G).all())
+    assert_true((indptr == indptr_G).all() and (indices == indices_G).all())
+    (x, y, z) = pyperc.graphics._line_coordinates(pos, [0, 1], [1, 5])
+    assert_equal(len(x), 6)
+    assert_true(all(map(isnan, [x[2], y[5], z[2]])))
+    
+    occupied = ip.pores.index[ip.pores.z == 0].tolist()
+    pyperc.graphics.plot_3d_network(ip, occupied, filename=filename, auto_open=False)
+    
+    assert_true(isfile(filename))
+    os.remove(filename)
+    
+def test_plot_3D_invasion():
+    filename = abspath(join(testdir, 'plot_3D_invasion.html'))
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(20, 20, 20, 0.0005, (0.0002, 0.00005, 0.00001), 0, 123)
+    ip.initialize_pores([65], 1061, 797, 0.05)
+    ip.run(engine='heap')
+    num_cluster = ip.pores.occupy.sum()
+    num_front = ip.pores.neighbor.sum()
+    
+    for decimate in ['voxel', 'random']:
+        fig = pyperc.graphics.plot_3d_invasion(ip, max_points=num_cluster + num_front + 500, 
+                decimate=decimate, filename=filename, auto_open=False)
+        (cluster, front, untouched) = fig.data
+        assert_equal(len(cluster.x), num_cluster)
+        assert_equal(len(front.x), num_front)
+        assert_true(0 < len(untouched.x) <= 500)
+    
+    fig = pyperc.graphics.plot_3d_invasion(ip, max_points=1000, cluster='mesh', 
+                                           filename=filename, auto_open=False)
+    assert_equal(fig.data[0].type, 'mesh3d')
+    assert_equal(len(fig.data[0].x), 2*len(fig.data[0].i))
+    assert_true(isfile(filename))
+    os.remove(filename)
+    
+    # Voxels on a 2D slab grid are sized from its area
+    pos = np.stack(np.meshgrid(np.arange(100), [0], np.arange(100), indexing='ij'), 
+                   axis=-1).reshape(-1, 3)*0.01
+    (voxel, num_voxels, size) = pyperc.graphics._voxel_bins(pos, 1000)
+    assert_true(500 < num_voxels <= 1000)
+    assert_equal(voxel.max() + 1, num_voxels)
+    
+def test_invasion_animation():
+    filename = abspath(join(testdir, 'plot_3D_animation.html'))
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(10, 2, 10, 0.0005, (0.0002, 0.00005, 0.00001), 0, 123)
+    ip.initialize_pores([65], 1061, 797, 0.05)
+    ip.run(engine='heap')
+    N = len(ip.results)
+    
+    frames = list(pyperc.graphics.invasion_images(ip, frame_stride=7, plane='xz', position=1))
+    assert_equal([f[0] for f in frames], [0] + list(range(7, N, 7)) + [N])
+    assert_true(all(f[1].shape == (10, 10) for f in frames))
+    assert_equal(np.isfinite(frames[0][1]).sum(), 0)
+    in_plane = ip.pores.loc[ip.results.node, 'y'].values > 0
+    assert_equal(np.isfinite(frames[-1][1]).sum(), in_plane.sum())
+    
+    fig = pyperc.graphics.plot_3d_animation(ip, frame_stride=7, filename=filename, 
+                                            auto_open=False)
+    assert_equal(len(fig.frames), len(frames) - 1)
+    assert_equal(sum(len(trace.x) for trace in fig.data[1:]), N)
+    assert_true(isfile(filename))
+    os.remove(filename)
+    
+    # The frame stride is raised to keep at most max_frames frames
+    fig = pyperc.graphics.plot_3d_animation(ip, frame_stride=1, max_frames=10, 
+                                            filename=filename, auto_open=False)
+    assert_true(len(fig.frames) <= 10)
+    assert_equal(sum(len(trace.x) for trace in fig.data[1:]), N)
+    os.remove(filename)
+    
 if __name__ == '__main__':
     cmp = test_plot_3D_network()
     
\ No newline at end of file
@@ -1,7 +1,12 @@
 from nose.tools import *
 from os.path import abspath, dirname, join
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import networkx as nx
 import pyperc
 
 testdir = dirname(abspath(__file__))
@@ -21,6 +26,25 @@ def test_setup_grid():
     assert_equal(sum(ip.pores.loc[5,['x', 'y', 'z']].values == [1,2,0]),3)
     assert_equal(sum(ip.pores.loc[14,['x', 'y', 'z']].values == [0,1,2]),3)
 
+def test_setup_grid_adjacency():
+    ip = pyperc.model.InvasionPercolation()
+    Nx = 4
+    Ny = 3
+    Nz = 5
+    ip.setup_grid(Nx,Ny,Nz,0.5, 0, 0)
+    assert_true(ip._G is None)
+    
+    G = nx.grid_graph(dim=[Nz,Ny,Nx])
+    G = nx.relabel_nodes(G, dict([(key,key[0]+Nx*(key[1]+(Ny*key[2]))) for key in G.nodes()]))
+    for node in ip.pores.index:
+        i = ip.pores.index.get_loc(node)
+        csr_neigh = ip.pores.index[ip._indices[ip._indptr[i]:ip._indptr[i+1]]]
+        assert_set_equal(set(csr_neigh), set(G.adj[node].keys()))
+    
+    assert_equal(ip.G.number_of_nodes(), Nx*Ny*Nz)
+    assert_equal(ip.G.number_of_edges(), G.number_of_edges())
+    assert_equal(ip.G.nodes[18]['pos'], (1.0, 0.5, 0.5))
+
 def test_setup_network():
     ip = pyperc.model.InvasionPercolation()
     
@@ -28,6 +52,103 @@ def test_setup_network():
     pore_file = join(datadir,'simple_pore.txt')
     ip.setup_network(pore_file, throat_file)  
 
+def test_setup_network_chunksize():
+    throat_file = join(datadir,'simple_throat.txt'  )  
+    pore_file = join(datadir,'simple_pore.txt')
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_network(pore_file, throat_file)
+    ip_chunk = pyperc.model.InvasionPercolation()
+    ip_chunk.setup_network(pore_file, throat_file, chunksize=7)
+    
+    pd.testing.assert_frame_equal(ip.pores, ip_chunk.pores)
+    assert_true(np.array_equal(ip._indptr, ip_chunk._indptr))
+    assert_true(np.array_equal(ip._indices, ip_chunk._indices))
+
+@raises(ValueError)
+def test_setup_network_missing_pore():
+    pore_file = join(datadir,'simple_pore.txt')
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write('Throat File\n3\nThroat id\nStart pore id\nEnd pore id\n')
+        f.write('0 0 1\n1 0 9999\n')
+    try:
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_network(pore_file, f.name)
+    finally:
+        os.remove(f.name)
+
+def test_save_load_network():
+    throat_file = join(datadir,'simple_throat.txt'  )  
+    pore_file = join(datadir,'simple_pore.txt')
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_network(pore_file, throat_file)
+    
+    path = tempfile.mkdtemp()
+    try:
+        ip.save_network(path)
+        for mmap in [True, False]:
+            ip_load = pyperc.model.InvasionPercolation()
+            ip_load.load_network(path, mmap=mmap)
+            
+            pd.testing.assert_frame_equal(ip.pores, ip_load.pores)
+            assert_true(np.array_equal(ip._indptr, ip_load._indptr))
+            assert_true(np.array_equal(ip._indices, ip_load._indices))
+            assert_equal(isinstance(ip_load._indices, np.memmap), mmap)
+            
+            # Pore values can be modified without changing the file
+            ip_load.pores.loc[ip_load.pores.radius < 0.02, 'radius'] = 0.02
+        
+        ip_load = pyperc.model.InvasionPercolation()
+        ip_load.load_network(path)
+        pd.testing.assert_frame_equal(ip.pores, ip_load.pores)
+        del ip_load
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def test_adjacency():
+    ip = pyperc.model.InvasionPercolation()
+    
+    throat_file = join(datadir,'simple_throat.txt'  )  
+    pore_file = join(datadir,'simple_pore.txt')
+    ip.setup_network(pore_file, throat_file)
+    
+    assert_equal(ip._indptr.dtype, np.int32)
+    assert_equal(ip._indices.dtype, np.int32)
+    assert_equal(len(ip._indptr), len(ip.pores)+1)
+    
+    throats = np.loadtxt(throat_file, skiprows=5, dtype=int)
+    G = nx.Graph()
+    G.add_edges_from(throats[:,1:])
+    for node, neigh in G.adj.items():
+        i = ip.pores.index.get_loc(node)
+        csr_neigh = ip.pores.index[ip._indices[ip._indptr[i]:ip._indptr[i+1]]]
+        assert_set_equal(set(csr_neigh), set(neigh.keys()))
+        assert_set_equal(set(ip.A[node]), set(neigh.keys()))
+    assert_equal(list(ip._nf), [len(ip.A[node]) for node in ip.pores.index])
+
+def test_lazy_graph():
+    ip = pyperc.model.InvasionPercolation()
+    
+    throat_file = join(datadir,'simple_throat.txt'  )  
+    pore_file = join(datadir,'simple_pore.txt')
+    ip.setup_network(pore_file, throat_file)
+    assert_true(ip._G is None)
+    
+    G = ip.G
+    assert_true(ip.G is G) # cached
+    assert_equal(G.number_of_nodes(), len(ip.pores))
+    assert_equal(2*G.number_of_edges(), len(ip._indices))
+    assert_equal(G.nodes[3]['pos'], (0.01, 0.01, 0.0))
+    A = ip.A
+    assert_true(ip.A is A) # cached
+    
+    # Setting G replaces the adjacency
+    G = G.copy()
+    G.remove_edge(0, 1)
+    ip.G = G
+    assert_false(1 in ip.A[0])
+    assert_false(0 in ip.A[1])
+
 def test_initialize_pores():
     ip = pyperc.model.InvasionPercolation()
     Nx = 2
@@ -44,6 +165,22 @@ def test_initialize_pores():
     ip.initialize_pores(contact_angles, invading_fluid_density, 
                     defending_fluid_density, surface_tension)
     
+    for col in ['start', 'end', 'occupy', 'neighbor']:
+        assert_equal(ip.pores[col].dtype, np.uint8)
+    assert_equal(ip.pores.start.sum(), Nx*Ny)
+    assert_equal(ip.pores.end.sum(), Nx*Ny)
+    assert_true(np.allclose(ip.pores.pt, ip.pores.pc + ip.pores.pg))
+    
+    # One contact angle per grain type, NaN for grain types without an angle
+    grain = np.arange(Nx*Ny*Nz) % 4
+    ip.setup_grid(Nx,Ny,Nz,cell_size,radius,grain)
+    ip.initialize_pores([30, 65, 120], invading_fluid_density, 
+                    defending_fluid_density, surface_tension, dtype=np.float32)
+    assert_true(np.array_equal(ip.pores.angle.values[grain < 3], 
+                               np.array([30, 65, 120])[grain[grain < 3]]))
+    assert_true(ip.pores.angle[grain == 3].isnull().all())
+    assert_equal(ip.pores.pt.dtype, np.float32)
+    
 def test_run():
     ip = pyperc.model.InvasionPercolation()
     Nx = 2
@@ -61,4 +198,505 @@ def test_run():
                     defending_fluid_density, surface_tension)
     ip.run()
     
-    assert_equal(sum(ip.results.node == [6,9,10,7,13,15,14,11,19]),9)
\ No newline at end of file
+    assert_equal(sum(ip.results.node == [6,9,10,7,13,15,14,11,19]),9)
+
+def test_run_heap():
+    contact_angles = [65]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    
+    results = {}
+    for engine in ['pandas', 'heap']:
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_grid(8,8,8,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+        ip.initialize_pores(contact_angles, invading_fluid_density, 
+                        defending_fluid_density, surface_tension)
+        ip.run(engine=engine)
+        results[engine] = ip
+    
+    pd.testing.assert_frame_equal(results['pandas'].results, results['heap'].results)
+    pd.testing.assert_frame_equal(results['pandas'].pores, results['heap'].pores)
+
+def test_run_ensemble():
+    contact_angles = [65]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    seeds = [1, 2, 3]
+    p = 0.2
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(4,4,6,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+    ip.initialize_pores(contact_angles, invading_fluid_density, 
+                    defending_fluid_density, surface_tension)
+    pores = ip.pores.copy()
+    
+    occupancy, realizations = ip.run_ensemble(seeds, p, n_workers=2)
+    pd.testing.assert_frame_equal(ip.pores, pores)
+    assert_equal(list(realizations.seed), seeds)
+    
+    count = 0
+    for i, seed in enumerate(seeds):
+        ip.pores = pores.copy()
+        ip.run(p=p, seed=seed)
+        count = count + ip.pores.occupy
+        assert_equal(realizations.loc[i, 'iterations'], len(ip.results))
+        assert_almost_equal(realizations.loc[i, 'threshold'], ip.results.threshold.max())
+        assert_true(realizations.loc[i, 'breakthrough'])
+    assert_true(np.allclose(occupancy.values, count.values/len(seeds)))
+    
+    # Realizations start from the start pores, not the occupancy left by the 
+    # previous run, with any engine
+    for engine in ['heap', 'numba']:
+        occupancy, realizations = ip.run_ensemble(seeds, p, engine=engine, n_workers=2)
+        for i, seed in enumerate(seeds):
+            ip_seed = pyperc.model.InvasionPercolation()
+            ip_seed.setup_grid(4,4,6,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+            ip_seed.pores = pores.copy()
+            ip_seed.run(p=p, seed=seed, engine=engine)
+            assert_equal(realizations.loc[i, 'iterations'], len(ip_seed.results))
+            assert_almost_equal(realizations.loc[i, 'threshold'], 
+                                ip_seed.results.threshold.max())
+
+
+def test_sweep():
+    contact_angles = [[65], [120]]
+    invading_fluid_density = [1000]
+    defending_fluid_density = [800, 1200]
+    surface_tension = [0.05, 0.03] # N/m
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(4,4,6,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+    
+    results = ip.sweep(contact_angles, invading_fluid_density, 
+                       defending_fluid_density, surface_tension, n_workers=2)
+    assert_equal(len(results), 8)
+    assert_false('pt' in ip.pores.columns)
+    
+    pores = ip.pores.copy()
+    for i, row in results.iterrows():
+        ip.pores = pores.copy()
+        ip.initialize_pores(list(row.contact_angles), row.invading_density, 
+                            row.defending_density, row.tension)
+        ip.run()
+        assert_equal(row.iterations, len(ip.results))
+        assert_equal(row.threshold, ip.results.threshold.max())
+        assert_almost_equal(row.saturation, ip.pores.occupy.mean())
+    
+    # The heap engine gives the same results, and runs start from the start 
+    # pores, not the occupancy left by a previous run
+    ip.pores = pores.copy()
+    ip.initialize_pores([65], 1000, 800, 0.05)
+    ip.run()
+    heap = ip.sweep(contact_angles, invading_fluid_density, defending_fluid_density, 
+                    surface_tension, engine='heap', n_workers=2)
+    pd.testing.assert_frame_equal(heap, results)
+    
+    # Grain types outside of contact_angles give NaN pressures, as in 
+    # initialize_pores
+    grain = np.arange(4*4*6) % 2
+    ip.setup_grid(4,4,6,0.0005,(0.0002, 0.00005, 0.00001),grain,123)
+    results = ip.sweep([[65]], [1000], [800], [0.05], n_workers=1)
+    ip.initialize_pores([65], 1000, 800, 0.05)
+    ip.run()
+    assert_equal(results.iterations[0], len(ip.results))
+    assert_equal(results.threshold[0], ip.results.threshold.max())
+
+def test_network_state():
+    contact_angles = [65]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(6,6,6,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+    ip.initialize_pores(contact_angles, invading_fluid_density, 
+                    defending_fluid_density, surface_tension)
+    network = ip.network
+    pt = ip.pores.pt.values
+    end = ip.pores.end.values > 0
+    start = ip.pores.occupy.values > 0
+    
+    assert_raises(ValueError, network.radius.__setitem__, 0, 1.0)
+    assert_raises(ValueError, network.indices.__setitem__, 0, 1)
+    
+    # Reuse one state for several runs
+    state = pyperc.model.SimulationState(network.num_pores)
+    for max_iterations in [5, -1, 10]:
+        state.reset(start)
+        pyperc.model.invade(network, pt, end, state, max_iterations)
+    (node, thresh) = state.fill_order()
+    assert_equal(len(node), 11)
+    
+    # Concurrent runs on one network
+    def run_one(i):
+        state = pyperc.model.SimulationState(network.num_pores)
+        state.reset(start)
+        pyperc.model.invade(network, pt, end, state)
+        return state.fill_order()
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(run_one, range(4)))
+    
+    ip.run(engine='heap')
+    for (node, thresh) in outputs:
+        assert_true(np.array_equal(network.index[node], ip.results.node.values))
+        assert_true(np.array_equal(thresh, ip.results.threshold.values))
+
+def test_stop_criteria():
+    contact_angles = [65]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(5,5,5,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+    ip.initialize_pores(contact_angles, invading_fluid_density, 
+                    defending_fluid_density, surface_tension)
+    pores = ip.pores.copy()
+    N = len(pores)
+    
+    for kwds in [{'n_outlets': 3}, {'max_saturation': 0.5, 'n_outlets': N}, 
+                 {'max_pressure': -250, 'n_outlets': N}, {'max_iterations': 4}, 
+                 {'time_limit': 0}]:
+        results = {}
+        for engine in ['pandas', 'heap']:
+            ip.pores = pores.copy()
+            ip.run(engine=engine, **kwds)
+            results[engine] = ip.results
+        pd.testing.assert_frame_equal(results['pandas'], results['heap'])
+        
+        occupy = ip.pores.occupy
+        if kwds.get('n_outlets') == 3:
+            assert_equal(sum(occupy & ip.pores.end), 3)
+        if 'max_saturation' in kwds:
+            assert_equal(occupy.sum(), int(np.ceil(0.5*N)))
+        if 'max_pressure' in kwds:
+            assert_true(ip.results.threshold.iloc[-1] > -250)
+            assert_true(ip.results.threshold.iloc[:-1].max() <= -250)
+        if 'max_iterations' in kwds:
+            assert_equal(len(ip.results), 5)
+        if 'time_limit' in kwds:
+            assert_true(len(ip.results) <= 1)
+
+def test_run_heap_stochastic():
+    # Small version of examples/random_porous_media_example.py
+    Nx = 30
+    Ny = 1
+    Nz = 30
+    cell_size = 0.01
+    np.random.seed(123456)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    
+    results = {}
+    for engine in ['pandas', 'heap']:
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_grid(Nx,Ny,Nz,cell_size,radius)
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        ip.pores.start = 0
+        ip.pores.end = 0
+        ip.pores.loc[(ip.pores.z == max(ip.pores.z)) & \
+                     (ip.pores.x >= Nx*(1/3)*cell_size) & \
+                     (ip.pores.x <= Nx*(2/3)*cell_size),'start'] = 1
+        ip.pores.loc[ip.pores.z == 0,'end'] = 1
+        ip.pores.occupy = ip.pores.start
+        ip.run(p=0.2, seed=5, engine=engine)
+        results[engine] = ip
+    
+    assert_true(len(results['heap'].results) > 100)
+    pd.testing.assert_frame_equal(results['pandas'].results, results['heap'].results)
+    pd.testing.assert_frame_equal(results['pandas'].pores, results['heap'].pores)
+
+def test_run_streaming():
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(123)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    
+    for engine in ['pandas', 'heap']:
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        batches = []
+        ip.run(engine=engine, callback=lambda *batch: batches.append(batch), 
+               batch_size=7)
+        
+        assert_true(len(batches) > 1)
+        assert_true(all(len(b[0]) == 7 for b in batches[:-1]))
+        iteration = np.concatenate([b[0] for b in batches])
+        node = np.concatenate([b[1] for b in batches])
+        threshold = np.concatenate([b[2] for b in batches])
+        assert_true(np.array_equal(iteration, np.arange(len(ip.results))))
+        assert_true(np.array_equal(node, ip.results.node.values))
+        assert_true(np.array_equal(threshold, ip.results.threshold.values))
+    
+    results = ip.results
+    ip.initialize_pores([124], 1400, 1000, 0.03)
+    node = np.concatenate([b[1] for b in ip.iter_run(batch_size=50)])
+    assert_true(np.array_equal(node, results.node.values))
+    pd.testing.assert_frame_equal(ip.results, results)
+    
+    # iter_run checks parameters as run does, and yields nothing if invalid
+    for kwds in [{'p': 5}, {'p': 0.2, 'trapping': True}, {'engine': 'pandas'}, 
+                 {'batch': True, 'checkpoint': 'checkpoint.npz'}]:
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        assert_equal(list(ip.iter_run(**kwds)), [])
+        assert_equal(ip.pores.occupy.sum(), Nx*Ny)
+
+def test_run_trapping():
+    Nx = 5
+    Ny = 1
+    Nz = 6
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(Nx,Ny,Nz,1,0.0002,0)
+    ip.initialize_pores([65], 1000, 800, 0.05)
+    
+    # Low pressure ring around pore (2,2) and a barrier at z = 4 with one 
+    # opening, so the defending fluid in pore (2,2) is trapped
+    pt = np.full((Nz,Nx), 10.0)
+    pt[1:4,1:4] = 0
+    pt[2,2] = 50
+    pt[4,:] = 1000
+    pt[4,4] = 100
+    pt[5,:] = 0
+    ip.pores['pt'] = pt.flatten()
+    center = 2 + Nx*2
+    pores = ip.pores.copy()
+    
+    ip.run(engine='heap')
+    assert_true(center in ip.results.node.values)
+    
+    results = {}
+    for engine in ['pandas', 'heap']:
+        ip.pores = pores.copy()
+        ip.run(engine=engine, trapping=True)
+        results[engine] = ip
+        
+        assert_false(center in ip.results.node.values)
+        assert_equal(ip.pores.loc[center, 'occupy'], 0)
+        assert_equal(ip.pores.loc[center, 'trapped'], 1)
+        assert_equal(ip.pores.trapped.sum(), 1)
+        assert_equal(ip.results.node.values[-1], 4 + Nx*5)
+    pd.testing.assert_frame_equal(results['pandas'].results, results['heap'].results)
+    pd.testing.assert_frame_equal(results['pandas'].pores, results['heap'].pores)
+
+def test_run_facilitation():
+    contact_angles = [120]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    
+    ip = pyperc.model.InvasionPercolation()
+    ip.setup_grid(6,6,8,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+    ip.initialize_pores(contact_angles, invading_fluid_density, 
+                    defending_fluid_density, surface_tension)
+    pores = ip.pores.copy()
+    ip.run(engine='heap')
+    no_facilitation = ip.results
+    
+    for p in [0, 0.2]:
+        results = {}
+        for engine in ['pandas', 'heap']:
+            ip.pores = pores.copy()
+            ip.run(p=p, seed=3, engine=engine, facilitation=True)
+            results[engine] = ip
+        pd.testing.assert_frame_equal(results['pandas'].results, results['heap'].results)
+        pd.testing.assert_frame_equal(results['pandas'].pores, results['heap'].pores)
+    
+        if p == 0:
+            assert_false(no_facilitation.equals(ip.results))
+    
+    # Facilitated pressure of a front pore
+    front = np.flatnonzero(ip.pores.neighbor.values)[0]
+    neigh = ip._indices[ip._indptr[front]:ip._indptr[front+1]]
+    n = ip.pores.occupy.values[neigh].sum()
+    nf = len(neigh)
+    expected = pores.pg.values[front] + pores.pc.values[front]/(2-(n-1)/(nf-1))
+    assert_almost_equal(ip.pores.pt.values[front], expected)
+
+def test_resume():
+    contact_angles = [120]
+    invading_fluid_density = 1000
+    defending_fluid_density = 800
+    surface_tension = 0.05 # N/m
+    
+    path = tempfile.mkdtemp()
+    try:
+        checkpoint = join(path, 'checkpoint.npz')
+        for kwds in [{'p': 0}, {'p': 0.3, 'seed': 7, 'facilitation': True}, 
+                     {'p': np.float64(0.2), 'seed': np.int64(3)}]:
+            ip = pyperc.model.InvasionPercolation()
+            ip.setup_grid(6,6,8,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+            ip.initialize_pores(contact_angles, invading_fluid_density, 
+                            defending_fluid_density, surface_tension)
+            ip.run(engine='heap', checkpoint=checkpoint, checkpoint_interval=10, **kwds)
+            assert_true(len(ip.results) > 20)
+            
+            # Resume from the last checkpoint, as if the run was interrupted
+            ip_resume = pyperc.model.InvasionPercolation()
+            ip_resume.setup_grid(6,6,8,0.0005,(0.0002, 0.00005, 0.00001),0,123)
+            ip_resume.initialize_pores(contact_angles, invading_fluid_density, 
+                            defending_fluid_density, surface_tension)
+            ip_resume.resume(checkpoint)
+            
+            pd.testing.assert_frame_equal(ip.results, ip_resume.results)
+            pd.testing.assert_frame_equal(ip.pores, ip_resume.pores)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def test_run_numba():
+    # The numba engine falls back to the heap engine if numba is not installed
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(42)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    
+    for kwds in [{'p': 0}, {'p': 0, 'trapping': True}, {'p': 0, 'facilitation': True}, 
+                 {'p': 0.2, 'seed': 3}, {'p': 0.2, 'seed': 3, 'facilitation': True}, 
+                 {'p': 0, 'max_pressure': 0, 'n_outlets': 3}]:
+        results = {}
+        for engine in ['heap', 'numba']:
+            ip = pyperc.model.InvasionPercolation()
+            ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+            ip.initialize_pores([124], 1400, 1000, 0.03)
+            ip.run(engine=engine, batch_size=33, **kwds)
+            results[engine] = ip
+        
+        assert_true(len(results['numba'].results) > 0)
+        pd.testing.assert_frame_equal(results['heap'].results, results['numba'].results)
+        pd.testing.assert_frame_equal(results['heap'].pores, results['numba'].pores)
+    
+    # pc is only required for facilitation, as in the pandas engine
+    for engine in ['pandas', 'heap', 'numba']:
+        ip = pyperc.model.InvasionPercolation()
+        ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        ip.pores = ip.pores.drop(columns='pc')
+        ip.run(engine=engine)
+        results[engine] = ip.results
+    pd.testing.assert_frame_equal(results['pandas'], results['heap'])
+    pd.testing.assert_frame_equal(results['pandas'], results['numba'])
+    
+    path = tempfile.mkdtemp()
+    try:
+        checkpoint = join(path, 'checkpoint.npz')
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        ip.run(p=0.2, seed=3, engine='numba', checkpoint=checkpoint, checkpoint_interval=50)
+        results = ip.results
+        ip.initialize_pores([124], 1400, 1000, 0.03)
+        ip.resume(checkpoint)
+        pd.testing.assert_frame_equal(ip.results, results)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def test_run_nan_pressure():
+    # Pores with a grain type outside of contact_angles have NaN pressures 
+    # and are never filled, by any engine
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(123)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    grain = np.zeros(Nx*Ny*Nz, dtype=int)
+    grain[::7] = 1
+    
+    for kwds in [{'p': 0}, {'p': 0, 'facilitation': True}, {'p': 0.3, 'seed': 3}]:
+        results = {}
+        for engine in ['pandas', 'heap', 'numba']:
+            ip = pyperc.model.InvasionPercolation()
+            ip.setup_grid(Nx,Ny,Nz,0.01,radius,grain)
+            ip.initialize_pores([124], 1400, 1000, 0.03)
+            ip.run(engine=engine, **kwds)
+            results[engine] = ip
+        
+        assert_true(len(results['pandas'].results) > 0)
+        assert_false(results['pandas'].results.threshold.isna().any())
+        for engine in ['heap', 'numba']:
+            pd.testing.assert_frame_equal(results['pandas'].results, results[engine].results)
+            assert_equal(list(results['pandas'].pores.occupy), list(results[engine].pores.occupy))
+
+def test_run_tied_pressure():
+    # Radii clipped at the minimum radius give tied pressures, which are 
+    # broken by pore position in every engine
+    for kwds in [{'p': 0}, {'p': 0.2, 'seed': 0}, {'p': 0.2, 'seed': 0, 'facilitation': True}]:
+        results = {}
+        for engine in ['pandas', 'heap', 'numba']:
+            ip = pyperc.model.InvasionPercolation()
+            ip.setup_grid(20,1,20,0.0005,(0.0002, 0.00005, 0.00015),0,123)
+            ip.initialize_pores([65], 1000, 800, 0.05)
+            ip.run(engine=engine, **kwds)
+            results[engine] = ip.results
+        
+        assert_true(ip.pores.pc.duplicated().any())
+        pd.testing.assert_frame_equal(results['pandas'], results['heap'])
+        pd.testing.assert_frame_equal(results['pandas'], results['numba'])
+
+def test_run_stats():
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(123)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    
+    for engine in ['pandas', 'heap', 'numba']:
+        for facilitation in [False, True]:
+            ip = pyperc.model.InvasionPercolation()
+            ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+            ip.initialize_pores([124], 1400, 1000, 0.03)
+            ip.run(engine=engine)
+            assert_equal(ip.run_stats, None)
+            
+            ip.initialize_pores([124], 1400, 1000, 0.03)
+            reports = []
+            ip.run(engine=engine, facilitation=facilitation, batch_size=10, profile=True, 
+                   progress=lambda stats: reports.append(stats.iterations))
+            stats = ip.run_stats
+            
+            N = len(ip.results)
+            assert_equal(stats.iterations, N)
+            assert_equal(reports, list(range(10, N, 10)) + [N])
+            assert_equal(list(stats.front.columns), ['iteration', 'front_size', 'elapsed'])
+            assert_equal(stats.front.iteration.iloc[-1], N)
+            assert_equal(stats.front.front_size.iloc[-1], ip.pores.neighbor.sum())
+            assert_true(stats.fills_per_second > 0)
+            if engine == 'numba' and pyperc.model.numba is not None:
+                assert_equal(list(stats.phase_time), ['kernel'])
+            else:
+                phases = {'stop_criteria', 'select', 'update_neighbors'}
+                if facilitation:
+                    phases.add('facilitation')
+                assert_equal(set(stats.phase_time), phases)
+                assert_equal(stats.calls['select'], N)
+
+def test_run_batch():
+    Nx = 20
+    Ny = 1
+    Nz = 20
+    np.random.seed(7)
+    radius = np.random.lognormal(-9.0, 0.9, Nx*Ny*Nz)
+    
+    for n_outlets in [1, Nx]:
+        results = {}
+        for engine in ['heap', 'numba']:
+            for batch in [False, True]:
+                ip = pyperc.model.InvasionPercolation()
+                ip.setup_grid(Nx,Ny,Nz,0.01,radius)
+                ip.initialize_pores([124], 1400, 1000, 0.03)
+                ip.run(engine=engine, batch=batch, n_outlets=n_outlets)
+                results[engine, batch] = ip.results
+        
+        pd.testing.assert_frame_equal(results['heap', True], results['numba', True])
+        exact = results['heap', False]
+        flood = results['heap', True]
+        assert_equal(exact.threshold.max(), flood.threshold.max())
+        if n_outlets == Nx:
+            # Same pores below each running maximum threshold
+            assert_equal(set(exact.node), set(flood.node))
+            assert_true(np.array_equal(np.unique(exact.threshold.cummax()), 
+                                       np.unique(flood.threshold.cummax())))
+    
+    ip.initialize_pores([124], 1400, 1000, 0.03)
+    assert_equal(ip.run(p=0.1, engine='heap', batch=True), None)
+    assert_equal(ip.run(engine='pandas', batch=True), None)